@@ -1,8 +1,40 @@
 """Helper functions for loading data and getting paths to figures."""
 
+from __future__ import annotations
+
+import json
+import os
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import lru_cache
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .instrumentation import stage
 from .path_conf import figure_root_dir
 
+# The n_out value that is used for the reference series in the consolidated store
+_REFERENCE_N_OUT = 0
+# The canonical columns of the consolidated store; the values are stored as float64,
+# the original name & dtype of the series are stored (as JSON) in the meta column
+_INDEX_COL, _VALUE_COL, _META_COL = "index", "value", "series_meta"
+_KEY_COLS = ("aggregator", "n_out", _META_COL)
+
 
 def get_data_path(data, n, n_out, aggregator, **kwargs):
     """Get the path to the data file for the given parameters."""
@@ -12,13 +44,328 @@ def get_data_path(data, n, n_out, aggregator, **kwargs):
     )
 
 
+def get_agg_store_path(data, n, **kwargs) -> Path:
+    """Get the path to the consolidated store of the given data and n."""
+    return figure_root_dir / f"data/{data}_{n}.agg.parquet"
+
+
 def get_series(aggregator, data, n, n_out=None, **kwargs) -> pd.Series:
-    """Get the (aggregated) series for the given parameters."""
-    df = pd.read_parquet(get_data_path(data, n, n_out, aggregator, **kwargs))
+    """Get the (aggregated) series for the given parameters.
+
+    If a consolidated store exists for the `data` and `n`, only the row group of the
+    series is read from it. Otherwise, the per-aggregation Parquet file is read.
+    """
+    store_path = get_agg_store_path(data, n)
+    if store_path.exists():
+        return read_agg_store_series(store_path, aggregator, n_out)
+    return read_series(get_data_path(data, n, n_out, aggregator, **kwargs))
+
+
+def read_series(path: str | Path) -> pd.Series:
+    """Read a series which was written as ``s.reset_index().to_parquet(path)``."""
+    with stage("parquet.read") as st:
+        df = pd.read_parquet(path)
+        if st:
+            st.add_bytes(read=os.path.getsize(path))
     df = df.set_index(df.columns[0])
     return df.iloc[:, 0]
 
 
+class SeriesArrays(NamedTuple):
+    """Zero-copy numpy view of a series; mimics the `index` and `values` attributes."""
+
+    index: np.ndarray
+    values: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return self.index.nbytes + self.values.nbytes
+
+
+class SeriesCache(Mapping):
+    """Lazy, memory-bounded, dict-like cache of (aggregated) series.
+
+    A series is only loaded on its first access, and the least recently used series
+    are evicted once the cached series exceed the byte budget. As such, a (forked)
+    worker only holds the series that it actually touches.
+
+    Example
+    -------
+    >>> agg_data_dict = SeriesCache.from_agg_data_csv(
+    ...     loc_data_dir / "agg_data.csv", reference=False, max_bytes=2**30
+    ... )
+    >>> agg_data_dict["btc_M4Aggregator_50000_1000"]  # loaded on first access
+
+    """
+
+    def __init__(
+        self,
+        loaders: Dict[Hashable, Callable[[], pd.Series]],
+        max_bytes: Optional[int] = None,
+        as_numpy: bool = False,
+    ):
+        """
+        Parameters
+        ----------
+        loaders : Dict[Hashable, Callable[[], pd.Series]]
+            A dict with, for each key, a function that loads its series.
+        max_bytes : int, optional
+            The byte budget of the cached series, by default None. If None, no
+            series is ever evicted.
+        as_numpy : bool, optional
+            Whether to store (and return) the series as :class:`SeriesArrays`, i.e.,
+            zero-copy numpy arrays of the index and values, by default False.
+
+        """
+        self._loaders = loaders
+        self.max_bytes = max_bytes
+        self.as_numpy = as_numpy
+        self._cache: OrderedDict = OrderedDict()
+        self._nbytes: Dict[Hashable, int] = {}
+        self.nbytes = 0  # the number of bytes of the currently cached series
+
+    @classmethod
+    def from_agg_data_csv(
+        cls, csv_path: str | Path, reference: Optional[bool] = None, **kwargs
+    ) -> SeriesCache:
+        """Create a cache with the (reference and) aggregated series of a manifest.
+
+        The keys follow the notebook conventions, i.e., ``{data}_reference_{n}`` for
+        the reference series and ``{data}_{aggregator}_{n}_{n_out}`` for the
+        aggregated series. If `reference` is True (False), only the reference
+        (aggregated) series are included. The `kwargs` are passed to the constructor.
+        """
+        loaders = {}
+        for r in pd.read_csv(csv_path).itertuples():
+            if pd.isna(r.n_out):
+                key, n_out = f"{r.data}_{r.aggregator}_{r.n}", None
+            else:
+                key, n_out = f"{r.data}_{r.aggregator}_{r.n}_{int(r.n_out)}", int(
+                    r.n_out
+                )
+            if reference is not None and reference != (n_out is None):
+                continue
+            loaders[key] = lambda r=r, n_out=n_out: get_series(
+                r.aggregator, r.data, r.n, n_out
+            )
+        return cls(loaders, **kwargs)
+
+    @classmethod
+    def from_manifest(
+        cls, df_manifest: pd.DataFrame, reference: Optional[bool] = None, **kwargs
+    ) -> SeriesCache:
+        """Create a cache with the series of a manifest, read from its `path` column.
+
+        The manifest is e.g. a :meth:`scheduler.Scheduler.manifest` (or an
+        `agg_data.csv`, possibly migrated to consolidated stores). The keys and the
+        `reference` argument are the same as for :meth:`from_agg_data_csv`.
+        """
+        loaders = {}
+        for r in df_manifest.itertuples():
+            n_out = None if pd.isna(r.n_out) else int(r.n_out)
+            if reference is not None and reference != (n_out is None):
+                continue
+            key = f"{r.data}_{r.aggregator}_{r.n}" + (
+                "" if n_out is None else f"_{n_out}"
+            )
+            if str(r.path).endswith(".agg.parquet"):  # a consolidated store
+                loaders[key] = lambda r=r, n_out=n_out: read_agg_store_series(
+                    r.path, r.aggregator, n_out
+                )
+            else:
+                loaders[key] = lambda path=r.path: read_series(path)
+        return cls(loaders, **kwargs)
+
+    def __getitem__(self, key) -> Union[pd.Series, SeriesArrays]:
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        s = self._loaders[key]()
+        if self.as_numpy:
+            s = SeriesArrays(s.index.to_numpy(), s.to_numpy())
+            self._nbytes[key] = s.nbytes
+        else:
+            self._nbytes[key] = int(s.memory_usage(index=True, deep=False))
+        self.nbytes += self._nbytes[key]
+        self._cache[key] = s
+        self._evict()
+        return s
+
+    def _evict(self):
+        # NOTE: the most recently used series is always retained
+        while (
+            self.max_bytes is not None
+            and len(self._cache) > 1
+            and self.nbytes > self.max_bytes
+        ):
+            key, _ = self._cache.popitem(last=False)
+            self.nbytes -= self._nbytes.pop(key)
+
+    def __iter__(self):
+        return iter(self._loaders)
+
+    def __len__(self) -> int:
+        return len(self._loaders)
+
+    def __contains__(self, key) -> bool:
+        return key in self._loaders
+
+
+def write_agg_store(
+    path: str | Path, series_iter: Iterable[Tuple[str, Optional[int], pd.Series]]
+):
+    """Write (aggregated) series to a single consolidated Parquet file.
+
+    Each series is written as a separate row group, with the `aggregator` and `n_out`
+    as key columns. As such, a single series can be read without touching the
+    others (see :func:`read_agg_store_series`). The series are consumed one by one,
+    hence the memory usage is bounded by the largest series.
+
+    All series are stored in a canonical schema, i.e., an ``index`` column and a
+    float64 ``value`` column, as a Parquet file has a single schema. The original
+    (index) name and value dtype of each series are stored in a constant column of its
+    row group, and are restored by :func:`read_agg_store_series`.
+
+    Parameters
+    ----------
+    path : str | Path
+        The path of the consolidated Parquet file.
+    series_iter : Iterable[Tuple[str, Optional[int], pd.Series]]
+        An iterable of ``(aggregator, n_out, series)`` tuples; the `n_out` of the
+        reference series should be None. The index dtype should be castable to that
+        of the first series; the values should be numeric.
+
+    """
+    writer: Optional[pq.ParquetWriter] = None
+    try:
+        for aggregator, n_out, s in series_iter:
+            if not len(s):
+                # NOTE: an empty row group has no statistics, i.e., no readable key
+                raise ValueError(
+                    f"Cannot store the empty series of {(aggregator, n_out)} in {path}"
+                )
+            meta = {"name": s.name, "index_name": s.index.name, "dtype": str(s.dtype)}
+            meta = json.dumps(meta, default=str)
+            n_out = _REFERENCE_N_OUT if n_out is None else int(n_out)
+            tbl = pa.table(
+                {
+                    _INDEX_COL: pa.array(s.index),
+                    _VALUE_COL: s.to_numpy(dtype=np.float64, na_value=np.nan),
+                    "aggregator": pa.array([aggregator] * len(s), pa.string()),
+                    "n_out": pa.array(np.full(len(s), n_out, dtype=np.int64)),
+                    _META_COL: pa.array([meta] * len(s), pa.string()),
+                }
+            )
+            if writer is None:
+                writer = pq.ParquetWriter(path, tbl.schema)
+            elif tbl.schema != writer.schema:
+                tbl = tbl.cast(writer.schema)
+            # NOTE: pyarrow splits series which exceed its max row group size
+            writer.write_table(tbl, row_group_size=len(s))
+    finally:
+        if writer is not None:
+            writer.close()
+    _read_agg_store_row_groups.cache_clear()
+
+
+def _get_agg_store_row_groups(
+    path: str,
+) -> Dict[Tuple[str, int], Tuple[List[int], Optional[str]]]:
+    """Map the `(aggregator, n_out)` keys to their row groups & meta via the footer."""
+    # NOTE: the file its mtime & size are part of the cache key, so that a rewritten
+    # store (e.g., by another process) is not served from a stale footer
+    st = os.stat(path)
+    return _read_agg_store_row_groups(path, st.st_mtime_ns, st.st_size)
+
+
+@lru_cache(maxsize=128)
+def _read_agg_store_row_groups(
+    path: str, mtime_ns: int, size: int
+) -> Dict[Tuple[str, int], Tuple[List[int], Optional[str]]]:
+    md = pq.ParquetFile(path).metadata
+    names = [md.schema.column(i).name for i in range(md.num_columns)]
+    agg_col, n_out_col = names.index("aggregator"), names.index("n_out")
+    # NOTE: stores which were written before the canonical schema have no meta column
+    meta_col = names.index(_META_COL) if _META_COL in names else None
+    row_groups = {}
+    for i in range(md.num_row_groups):
+        rg = md.row_group(i)
+        # Each row group holds (a part of) a single series, so min == max == the key
+        key = (rg.column(agg_col).statistics.min, rg.column(n_out_col).statistics.min)
+        meta = None if meta_col is None else rg.column(meta_col).statistics.min
+        row_groups.setdefault(key, ([], meta))[0].append(i)
+    return row_groups
+
+
+def read_agg_store_series(path: str | Path, aggregator, n_out=None) -> pd.Series:
+    """Read a single series from a consolidated store (see :func:`write_agg_store`)."""
+    n_out = _REFERENCE_N_OUT if aggregator == "reference" or n_out is None else n_out
+    row_groups, meta = _get_agg_store_row_groups(str(path))[(aggregator, int(n_out))]
+    with stage("parquet.read") as st:
+        pf = pq.ParquetFile(path)
+        columns = [c for c in pf.schema_arrow.names if c not in _KEY_COLS]
+        df = pf.read_row_groups(row_groups, columns=columns).to_pandas()
+        if st:  # i.e., the (compressed) size of the column chunks that were read
+            md = pf.metadata
+            idxs = [pf.schema_arrow.get_field_index(c) for c in columns]
+            st.add_bytes(
+                read=sum(
+                    md.row_group(rg).column(i).total_compressed_size
+                    for rg in row_groups
+                    for i in idxs
+                )
+            )
+    df = df.set_index(df.columns[0])
+    s = df.iloc[:, 0]
+    if meta is not None:
+        meta = json.loads(meta)
+        s = s.astype(meta["dtype"]).rename(meta["name"]).rename_axis(meta["index_name"])
+    return s
+
+
+def migrate_agg_data_csv(csv_path: str | Path, remove: bool = False) -> pd.DataFrame:
+    """Migrate the per-aggregation Parquet files of an `agg_data.csv` manifest.
+
+    For each (data, n) combination, all listed files are written to one consolidated
+    store at :func:`get_agg_store_path`.
+
+    Parameters
+    ----------
+    csv_path : str | Path
+        The path to the `agg_data.csv` manifest (as created by the
+        `0.2_Create_agg_data.ipynb` notebook).
+    remove : bool, optional
+        Whether to remove the migrated per-aggregation files, by default False.
+
+    Returns
+    -------
+    pd.DataFrame
+        The manifest, with the `path` column pointing to the consolidated stores.
+
+    """
+    df_agg_data = pd.read_csv(csv_path)
+
+    def _read(r) -> Tuple[str, Optional[int], pd.Series]:
+        n_out = None if pd.isna(r.n_out) else int(r.n_out)
+        return r.aggregator, n_out, read_series(r.path)
+
+    store_paths = []
+    for (data, n), df_g in df_agg_data.groupby(["data", "n"], sort=False):
+        store_path = get_agg_store_path(data, n)
+        write_agg_store(store_path, (_read(r) for r in df_g.itertuples()))
+        store_paths.append(((data, n), store_path))
+        if remove:
+            for p in df_g.path:
+                Path(p).unlink()
+
+    store_paths = dict(store_paths)
+    df_agg_data["path"] = [
+        store_paths[(d, n)] for d, n in zip(df_agg_data.data, df_agg_data.n)
+    ]
+    return df_agg_data
+
+
 def get_png_path(
     toolkit,
     data,
@@ -1,16 +1,29 @@
 """Wittholds code for constructing figures with matplotlib and plotly."""
 
-from typing import Literal, Optional, Tuple
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Iterable, Literal, Optional, Tuple
 
 import matplotlib.lines as lines
 import matplotlib.pyplot as plt
+import matplotlib.transforms as mtransforms
 import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
+import plotly.io as pio
 from bokeh.io import export_png
-from bokeh.models import Range1d
+from bokeh.models import ColumnDataSource, Range1d
 from bokeh.plotting import figure
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
+from .instrumentation import instrumented, stage
 
+
+@instrumented("render.matplotlib")
 def return_matplotlib_arr(
     x,
     y,
@@ -24,6 +37,7 @@ def return_matplotlib_arr(
     ] = "default",
     xlim: Optional[Tuple] = None,
     ylim: Optional[Tuple] = None,
+    reuse_canvas: bool = True,
 ) -> np.ndarray:
     """Construct a matplotlib figure and return it as a numpy array.
 
@@ -52,12 +66,20 @@ def return_matplotlib_arr(
         x limits of the figure
     ylim : tuple
         y limits of the figure
+    reuse_canvas : bool
+        whether to render on a pooled canvas of the :class:`MatplotlibRenderer`,
+        defaults to True. The output is pixel-identical to a fresh figure.
 
     .. Note::
         If you want to ensure that the images are 1-to-1 comparable you should always
         set the xlim and ylim to the same values for all images.
 
     """
+    if reuse_canvas:
+        return _mpl_renderer.render_arr(
+            x, y, dpi, width, height, aa, line_width_px, drawstyle, xlim, ylim
+        )
+
     line_width_points = line_width_px / dpi * 72
     fig = plt.figure(frameon=False, dpi=dpi, linewidth=line_width_points)
     fig.set_size_inches(width / dpi, height / dpi)
@@ -87,6 +109,7 @@ def return_matplotlib_arr(
     return arr
 
 
+@instrumented("render.matplotlib")
 def construct_matplotlib_fig(
     x,
     y,
@@ -103,6 +126,7 @@ def construct_matplotlib_fig(
     ] = "default",
     return_fig=False,
     backend="agg",
+    reuse_canvas: bool = True,
 ):
     """Construct a matplotlib figure and save it to a file.
 
@@ -133,8 +157,32 @@ def construct_matplotlib_fig(
         'default', 'steps', 'steps-pre', 'steps-mid', 'steps-post'
     return_fig : bool
         whether to return the figure or not, defaults to False
+    backend : str
+        the matplotlib backend that is used to save the figure, e.g. 'agg' or
+        'cairo'
+    reuse_canvas : bool
+        whether to render on a pooled canvas of the :class:`MatplotlibRenderer`,
+        defaults to True. This is ignored when ``return_fig`` is True, as the caller
+        then owns the figure.
 
     """
+    if reuse_canvas and not return_fig:
+        _mpl_renderer.save_fig(
+            x,
+            y,
+            save_path,
+            dpi,
+            width,
+            height,
+            aa,
+            line_width_px,
+            drawstyle,
+            xlim,
+            ylim,
+            backend,
+        )
+        return
+
     line_width_points = line_width_px / dpi * 72
     fig = plt.figure(frameon=False, dpi=dpi, linewidth=line_width_points)
     fig.set_size_inches(width / dpi, height / dpi)
@@ -158,19 +206,247 @@ def construct_matplotlib_fig(
 
     # Add the line to the axes
     fig.add_axes(ax, projection=None)
-    fig.savefig(
-        save_path,
-        dpi=dpi,
-        # bbox_inches="tight",
-        pad_inches=0,
-        backend=backend,
-    )
+    with stage("png.encode") as st:
+        fig.savefig(
+            save_path,
+            dpi=dpi,
+            # bbox_inches="tight",
+            pad_inches=0,
+            backend=backend,
+        )
+        if st:
+            _add_written_bytes(st, save_path)
     if return_fig:
         return fig
     plt.close(fig)
     del fig, ax
 
 
+def _add_written_bytes(st, save_path):
+    """Add the size of the file at `save_path` (if it is a path) to the stage."""
+    if isinstance(save_path, (str, os.PathLike)):
+        st.add_bytes(written=os.path.getsize(save_path))
+
+
+def _write_png(path, arr: np.ndarray, compress_level: int = 1):
+    """Write a (height, width, 4) uint8 RGBA array as an unfiltered PNG file."""
+    height, width, _ = arr.shape
+
+    def _chunk(tag: bytes, data: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(data))
+            + tag
+            + data
+            + struct.pack(">I", zlib.crc32(tag + data))
+        )
+
+    # Each scanline is prefixed with its filter type, i.e., 0 (None)
+    with stage("png.encode") as st:
+        raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+        raw[:, 1:] = arr.reshape(height, -1)
+        with open(path, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n")
+            f.write(
+                _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            )
+            f.write(_chunk(b"IDAT", zlib.compress(raw.tobytes(), compress_level)))
+            f.write(_chunk(b"IEND", b""))
+            if st:
+                st.add_bytes(written=f.tell())
+
+
+def _get_ylim(y) -> Tuple:
+    """Return ``(min(y), max(y))``, computed with numpy when this is equivalent."""
+    y_min, y_max = np.min(y), np.max(y)
+    if np.isnan(y_min):  # the builtins their NaN handling depends on the position
+        return min(y), max(y)
+    return y_min, y_max
+
+
+class MatplotlibRenderer:
+    """Pool of reusable matplotlib figures, one per canvas configuration.
+
+    Creating (and closing) a figure, axes, and line is more expensive than drawing a
+    few thousand points. This renderer therefore keeps one figure per
+    (width, height, dpi, aa, backend) combination and, for each render, only updates
+    the line its data, width and drawstyle and the axes limits.
+
+    The figures are created with the Agg canvas directly, i.e., they are never
+    registered with pyplot its global figure manager.
+
+    .. Note::
+        The output is pixel-identical to the figures that are constructed from
+        scratch (i.e., ``reuse_canvas=False``).
+
+    """
+
+    def __init__(self, png_compress_level: Optional[int] = 1):
+        """
+        parameters
+        ----------
+        png_compress_level : int, optional
+            the zlib compression level (0-9) of the saved (agg) PNG files, defaults
+            to 1. PNG is lossless, so this only trades file size for encoding time,
+            which dominates the save time. If None, ``savefig`` is used.
+
+        """
+        self.png_compress_level = png_compress_level
+        self._canvases: Dict[Tuple, Tuple[Figure, Axes, lines.Line2D]] = {}
+        # matplotlib is not thread-safe, so a render holds the lock
+        self._lock = threading.Lock()
+
+    def _get_canvas(
+        self, x, dpi, width, height, aa, backend
+    ) -> Tuple[Figure, Axes, lines.Line2D]:
+        # NOTE: the unit converter of an axis is set on its first data, hence
+        # datetime and numeric x-data do not share a canvas
+        x_kind = getattr(x, "dtype", np.asarray(x[:1]).dtype).kind
+        key = (width, height, dpi, aa, backend, x_kind)
+        if key not in self._canvases:
+            fig = Figure(frameon=False, dpi=dpi)
+            FigureCanvasAgg(fig)
+            fig.set_size_inches(width / dpi, height / dpi)
+            # make an ax that is the size of the figure
+            ax = Axes(fig, [0.0, 0.0, 1.0, 1.0])
+            ax.set_axis_off()
+            line = ax.add_line(lines.Line2D(xdata=[], ydata=[], c="black", aa=aa))
+            fig.add_axes(ax, projection=None)
+            self._canvases[key] = fig, ax, line
+        return self._canvases[key]
+
+    def _update(
+        self,
+        x,
+        y,
+        dpi,
+        width,
+        height,
+        aa,
+        line_width_px,
+        drawstyle,
+        xlim,
+        ylim,
+        backend,
+    ) -> Tuple[Figure, lines.Line2D]:
+        fig, ax, line = self._get_canvas(x, dpi, width, height, aa, backend)
+        line_width_points = line_width_px / dpi * 72
+        fig.patch.set_linewidth(line_width_points)
+        line.set_data(x, y)
+        line.set_linewidth(line_width_points)
+        line.set_drawstyle(drawstyle)
+        # Scale x and y to the data ranges
+        ax.set_xlim((x[0], x[-1]) if xlim is None else xlim)
+        ax.set_ylim(_get_ylim(y) if ylim is None else ylim)
+        return fig, line
+
+    def render_arr(
+        self,
+        x,
+        y,
+        dpi=96,
+        width=800,
+        height=250,
+        aa: bool = True,
+        line_width_px: int = 1,
+        drawstyle: Literal[
+            "default", "steps", "steps-pre", "steps-mid", "steps-post"
+        ] = "default",
+        xlim: Optional[Tuple] = None,
+        ylim: Optional[Tuple] = None,
+    ) -> np.ndarray:
+        """Render the line and return the RGBA buffer as a (copied) numpy array.
+
+        See :func:`return_matplotlib_arr` for the parameters.
+        """
+        with self._lock:
+            fig, line = self._update(
+                x,
+                y,
+                dpi,
+                width,
+                height,
+                aa,
+                line_width_px,
+                drawstyle,
+                xlim,
+                ylim,
+                "agg",
+            )
+            try:
+                fig.canvas.draw()
+                # NOTE: the buffer is reused by the next render, hence the copy
+                return np.array(fig.canvas.buffer_rgba())
+            finally:
+                line.set_data([], [])  # release the (possibly large) data
+
+    def save_fig(
+        self,
+        x,
+        y,
+        save_path,
+        dpi=96,
+        width=800,
+        height=250,
+        aa=True,
+        line_width_px=1,
+        drawstyle: Literal[
+            "default", "steps", "steps-pre", "steps-mid", "steps-post"
+        ] = "default",
+        xlim: Optional[Tuple] = None,
+        ylim: Optional[Tuple] = None,
+        backend="agg",
+    ):
+        """Render the line and save it to `save_path`.
+
+        See :func:`construct_matplotlib_fig` for the parameters.
+        """
+        with self._lock:
+            fig, line = self._update(
+                x,
+                y,
+                dpi,
+                width,
+                height,
+                aa,
+                line_width_px,
+                drawstyle,
+                xlim,
+                ylim,
+                backend,
+            )
+            try:
+                if (
+                    self.png_compress_level is not None
+                    and backend == "agg"
+                    and str(save_path).endswith(".png")
+                ):
+                    # The Agg buffer is exactly what `savefig` encodes, but Pillow
+                    # its adaptive PNG filtering dominates the save time
+                    fig.canvas.draw()
+                    _write_png(
+                        save_path,
+                        np.asarray(fig.canvas.buffer_rgba()),
+                        self.png_compress_level,
+                    )
+                else:
+                    with stage("png.encode") as st:
+                        fig.savefig(save_path, dpi=dpi, pad_inches=0, backend=backend)
+                        if st:
+                            _add_written_bytes(st, save_path)
+            finally:
+                line.set_data([], [])
+
+    def clear(self):
+        """Drop all pooled figures."""
+        with self._lock:
+            self._canvases.clear()
+
+
+# The (per-process) renderer that is used by the matplotlib figure constructors
+_mpl_renderer = MatplotlibRenderer()
+
+
+@instrumented("render.plotly")
 def construct_plotly_fig(
     x,
     y,
@@ -237,10 +513,15 @@ def construct_plotly_fig(
     if ylim is not None:
         fig.update_yaxes(range=ylim)
 
-    with open(save_path, "wb") as f:
-        f.write(fig.to_image(format="png", width=width, height=height))
+    with stage("png.encode") as st:
+        img = fig.to_image(format="png", width=width, height=height)
+        with open(save_path, "wb") as f:
+            f.write(img)
+        if st:
+            st.add_bytes(written=len(img))
 
 
+@instrumented("render.bokeh")
 def construct_bokeh_fig(
     x,
     y,
@@ -307,4 +588,479 @@ def construct_bokeh_fig(
     p.min_border = 0
     p.outline_line_color = None
 
-    export_png(p, filename=save_path)
+    with stage("png.encode") as st:
+        export_png(p, filename=save_path)
+        if st:
+            _add_written_bytes(st, save_path)
+
+
+class PlotlyExporter:
+    """Session-based plotly PNG exporter, which reuses its validated figure template.
+
+    The figure layout is constructed (and validated) once per template, i.e., per
+    (width, height) combination; each export only swaps the trace its data, line
+    properties, and the axes ranges in the template its dict representation, and
+    skips the figure validation. All exports use the same kaleido (0.2) scope, i.e.,
+    its chromium subprocess is started once (by :meth:`start`) and then reused.
+
+    Example
+    -------
+    >>> with PlotlyExporter() as exporter:
+    ...     exporter.export_many(
+    ...         dict(x=x, y=y, save_path=p, line_width=lw) for p, lw in jobs
+    ...     )
+
+    .. Note::
+        The output is the same as :func:`construct_plotly_fig` its output.
+
+    """
+
+    def __init__(self):
+        self._templates: Dict[Tuple[int, int], dict] = {}
+
+    def start(self) -> "PlotlyExporter":
+        """Start the (per process) kaleido subprocess by exporting a tiny figure."""
+        pio.to_image(self.get_fig_dict([0, 1], [0, 1], 10, 10), format="png")
+        return self
+
+    def close(self):
+        """Release the templates; the kaleido subprocess is stopped at exit."""
+        self._templates.clear()
+
+    def __enter__(self) -> "PlotlyExporter":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _get_template(self, width: int, height: int) -> dict:
+        if (width, height) not in self._templates:
+            fig = go.Figure()
+            axis_kwargs = dict(
+                showgrid=False, zeroline=False, automargin=False, showticklabels=False
+            )
+            fig.update_layout(
+                margin=dict(l=0, r=0, t=0, b=0, pad=0),
+                width=width,
+                height=height,
+                template=None,
+                xaxis=axis_kwargs,
+                yaxis=axis_kwargs,
+            )
+            fig.add_trace(go.Scatter(name="ball"))
+            self._templates[(width, height)] = fig.to_dict()
+        return self._templates[(width, height)]
+
+    def get_fig_dict(
+        self,
+        x,
+        y,
+        width=800,
+        height=250,
+        aa=True,
+        line_width=1,
+        line_shape: Literal["linear", "spline", "hv", "vhv", "hvh"] = "linear",
+        xlim=None,
+        ylim=None,
+    ) -> dict:
+        """Return the figure dict of a line chart, based on the (cached) template.
+
+        Only the (small) trace and axis dicts are copied, the layout its other
+        attributes are shared with the template.
+        """
+        assert aa, "Plotly does not support setting anti-aliasing to False."
+        template = self._get_template(width, height)
+        trace = dict(
+            template["data"][0],
+            line=dict(shape=line_shape, color="black", width=line_width),
+            x=x,
+            y=y,
+        )
+        layout = dict(template["layout"])
+        if xlim is not None:
+            layout["xaxis"] = dict(layout["xaxis"], range=list(xlim))
+        if ylim is not None:
+            layout["yaxis"] = dict(layout["yaxis"], range=list(ylim))
+        return dict(data=[trace], layout=layout)
+
+    def export(self, x, y, save_path, width=800, height=250, **kwargs):
+        """Export a single figure; see :func:`construct_plotly_fig` for the args."""
+        self.export_many(
+            [dict(x=x, y=y, save_path=save_path, width=width, height=height, **kwargs)]
+        )
+
+    @instrumented("render.plotly")
+    def export_many(self, jobs: Iterable[dict]):
+        """Export a batch of figures with the same kaleido scope.
+
+        parameters
+        ----------
+        jobs : Iterable[dict]
+            The keyword arguments of each figure, i.e., those of
+            :func:`construct_plotly_fig`.
+
+        """
+        for job in jobs:
+            job = dict(job)
+            path = job.pop("save_path")
+            width, height = job.get("width", 800), job.get("height", 250)
+            fig_dict = self.get_fig_dict(**job)
+            with stage("png.encode") as st:
+                img = pio.to_image(
+                    fig_dict, format="png", width=width, height=height, validate=False
+                )
+                with open(path, "wb") as f:
+                    f.write(img)
+                if st:
+                    st.add_bytes(written=len(img))
+
+
+class BokehExporter:
+    """Session-based bokeh PNG exporter with a single long-lived webdriver.
+
+    One template figure (with a :class:`ColumnDataSource` and fixed ranges) is kept
+    per (width, height, line_shape, has-xlim) combination; each export only updates
+    the source its data, the glyph its line width, and the range bounds in place.
+
+    Example
+    -------
+    >>> with BokehExporter() as exporter:
+    ...     for save_path, lw in jobs:
+    ...         exporter.export(x, y, save_path, line_width=lw, ylim=ylim)
+
+    .. Note::
+        The output is the same as :func:`construct_bokeh_fig` its output.
+
+    """
+
+    def __init__(self, webdriver=None):
+        """
+        parameters
+        ----------
+        webdriver : selenium.webdriver, optional
+            The webdriver that is used for the exports, by default None. If None, a
+            (headless) webdriver is created on the first export and closed by
+            :meth:`close`.
+
+        """
+        self.webdriver = webdriver
+        self._owns_webdriver = webdriver is None
+        self._templates: Dict[Tuple, Tuple] = {}
+
+    def start(self) -> "BokehExporter":
+        """Create the webdriver (when it was not passed to the constructor)."""
+        if self.webdriver is None:
+            from bokeh.io.webdriver import webdriver_control
+
+            self.webdriver = webdriver_control.create()
+        return self
+
+    def close(self):
+        """Quit the webdriver if it was created by this exporter."""
+        if self._owns_webdriver and self.webdriver is not None:
+            self.webdriver.quit()
+            self.webdriver = None
+
+    def __enter__(self) -> "BokehExporter":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _get_template(self, width, height, line_shape, has_xlim) -> Tuple:
+        key = (width, height, line_shape, has_xlim)
+        if key not in self._templates:
+            p = figure(width=width, height=height)
+            source = ColumnDataSource(data=dict(x=[], y=[]))
+            if line_shape == "default":
+                r = p.line("x", "y", source=source, line_color="black")
+            elif line_shape == "steps-mid":
+                r = p.step("x", "y", source=source, mode="center", line_color="black")
+            else:
+                raise ValueError(f"Invalid line-shape: {line_shape}")
+            p.axis.visible = False
+            p.xaxis.visible = False
+            p.yaxis.visible = False
+            p.xgrid.visible = False
+            p.ygrid.visible = False
+            p.min_border_left = 0
+            p.min_border_right = 0
+            p.min_border_top = 0
+            p.min_border_bottom = 0
+            if has_xlim:
+                p.x_range = Range1d(0, 1)
+            p.y_range = Range1d(0, 1)
+            p.background_fill_color = None
+            p.border_fill_color = None
+            p.toolbar_location = None
+            p.margin = 0
+            p.min_border = 0
+            p.outline_line_color = None
+            self._templates[key] = p, source, r
+        return self._templates[key]
+
+    def export(
+        self,
+        x,
+        y,
+        save_path,
+        width=800,
+        height=250,
+        aa=True,
+        line_width=1,
+        line_shape: Literal["default", "steps-mid"] = "default",
+        xlim=None,
+        ylim=None,
+    ):
+        """Export a single figure; see :func:`construct_bokeh_fig` for the args."""
+        assert aa, "Bokeh does not support setting anti-aliasing to False."
+        self.start()
+        p, source, r = self._get_template(width, height, line_shape, xlim is not None)
+        source.data = dict(x=x, y=y)
+        r.glyph.line_width = line_width
+        if xlim is not None:
+            p.x_range.update(start=xlim[0], end=xlim[-1])
+        p.y_range.update(start=ylim[0], end=ylim[-1])
+        try:
+            with stage("png.encode") as st:
+                export_png(p, filename=save_path, webdriver=self.webdriver)
+                if st:
+                    _add_written_bytes(st, save_path)
+        finally:
+            source.data = dict(x=[], y=[])  # release the (possibly large) data
+
+    @instrumented("render.bokeh")
+    def export_many(self, jobs: Iterable[dict]):
+        """Export a batch of figures with the same webdriver session.
+
+        parameters
+        ----------
+        jobs : Iterable[dict]
+            The keyword arguments of each figure, i.e., those of
+            :func:`construct_bokeh_fig`.
+
+        """
+        for job in jobs:
+            self.export(**job)
+
+
+def _is_datetime(a) -> bool:
+    """Whether array-like `a` holds (tz-naive or tz-aware) datetimes."""
+    if isinstance(getattr(a, "dtype", None), pd.DatetimeTZDtype):
+        return True
+    return np.asarray(a).dtype.kind == "M"
+
+
+def _to_float_arr(a, datetime: Optional[bool] = None, tz=None) -> np.ndarray:
+    """Convert (datetime) array-like data to a float64 array.
+
+    Datetimes (also tz-aware ones) are converted to their UTC epoch in ns, where
+    tz-naive datetimes are localized to `tz` (if given); as done for the `xlim` in
+    ``aggregators._get_xlim_arr``. If `datetime` is None, it is inferred from `a`.
+    """
+    if datetime is None:
+        datetime = _is_datetime(a)
+    if not datetime:
+        return np.asarray(a).astype(np.float64)
+    idx = pd.DatetimeIndex(a)
+    if idx.tz is None and tz is not None:
+        idx = idx.tz_localize(tz)
+    if idx.tz is not None:
+        idx = idx.tz_convert(None)  # i.e., UTC
+    return idx.values.astype("datetime64[ns]").view("int64").astype(np.float64)
+
+
+def _nonsingular(lim: Tuple) -> Tuple[float, float]:
+    """Expand degenerate (i.e., equal) axis limits, as matplotlib does."""
+    # NOTE: the expander of matplotlib its (default) AutoLocator
+    return mtransforms.nonsingular(float(lim[0]), float(lim[1]), expander=0.05)
+
+
+def _get_line_vertices(
+    x: np.ndarray,
+    y: np.ndarray,
+    drawstyle: Literal["default", "steps", "steps-pre", "steps-mid", "steps-post"],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the vertices of the (stepped) line, analogous to matplotlib."""
+    if drawstyle == "default" or len(x) < 2:
+        return x, y
+    if drawstyle in ("steps", "steps-pre"):
+        vx = np.repeat(x, 2)[:-1]
+        vy = np.repeat(y, 2)[1:]
+    elif drawstyle == "steps-post":
+        vx = np.repeat(x, 2)[1:]
+        vy = np.repeat(y, 2)[:-1]
+    elif drawstyle == "steps-mid":
+        mid = (x[:-1] + x[1:]) / 2
+        vx = np.concatenate(([x[0]], np.repeat(mid, 2), [x[-1]]))
+        vy = np.repeat(y, 2)
+    else:
+        raise ValueError(f"Invalid drawstyle: {drawstyle}")
+    return vx, vy
+
+
+def _rasterize_segments(
+    img: np.ndarray,
+    px0: np.ndarray,
+    py0: np.ndarray,
+    px1: np.ndarray,
+    py1: np.ndarray,
+    line_width_px: float,
+    aa: bool,
+):
+    """Rasterize the segments along their major axis into the coverage image.
+
+    The segments are sampled at the pixel centers of their major axis (as in
+    Bresenham / Wu's algorithm). At each sample, the coverage of the pixels along the
+    minor axis is the overlap of the pixel with the stroke its cross-section.
+    """
+    height, width = img.shape
+    # Transpose the minor-major axis such that the major axis is always the first
+    x_major = np.abs(px1 - px0) >= np.abs(py1 - py0)
+    a0, a1 = np.where(x_major, px0, py0), np.where(x_major, px1, py1)
+    b0, b1 = np.where(x_major, py0, px0), np.where(x_major, py1, px1)
+    swap = a0 > a1
+    a0, a1, b0, b1 = (
+        np.where(swap, a1, a0),
+        np.where(swap, a0, a1),
+        np.where(swap, b1, b0),
+        np.where(swap, b0, b1),
+    )
+    da = a1 - a0
+    slope = np.divide(b1 - b0, da, out=np.zeros_like(da), where=da > 0)
+    # The stroke its cross-section along the minor axis
+    half_w = line_width_px * np.sqrt(1 + slope**2) / 2
+
+    # Sample at the segment start and at each major-axis pixel center (within the
+    # image)
+    a_max = np.where(x_major, width, height)
+    first = np.maximum(np.ceil(a0 - 0.5), 0)
+    last = np.minimum(np.floor(a1 - 0.5), a_max - 1)
+    n_samples = np.maximum(last - first + 1, 0).astype(np.int64) + 1
+    seg = np.repeat(np.arange(len(a0)), n_samples)
+    offset = np.arange(len(seg)) - np.repeat(
+        np.cumsum(n_samples) - n_samples, n_samples
+    )
+    a = np.where(offset == 0, a0[seg], first[seg] + offset - 1 + 0.5)
+    b = b0[seg] + (a - a0[seg]) * slope[seg]
+    # Agg sets an aliased pixel as soon as the stroke touches it, hence the stroke
+    # is extended with the minor-axis shift within the pixel its major-axis span
+    ext = half_w if aa else half_w + np.minimum(np.abs(slope), 1) / 2
+    lo, hi = b - ext[seg], b + ext[seg]
+
+    # The coverage of each minor-axis pixel which intersects with the stroke
+    n_span = int(np.ceil(2 * ext.max())) + 1
+    a_pix = np.floor(a).astype(np.int64)
+    x_major_s = x_major[seg]
+    img_flat = img.reshape(-1)  # a view, as `img` is contiguous
+    for k in range(n_span + 1):
+        b_pix = np.floor(lo).astype(np.int64) + k
+        cov = np.clip(np.minimum(hi, b_pix + 1) - np.maximum(lo, b_pix), 0, 1)
+        if not aa:
+            cov = (cov > 1e-6).astype(cov.dtype)
+        col = np.where(x_major_s, a_pix, b_pix)
+        row = np.where(x_major_s, b_pix, a_pix)
+        m = (cov > 0) & (col >= 0) & (col < width) & (row >= 0) & (row < height)
+        # NOTE: a flat index is significantly faster than a (row, col) index
+        if aa:
+            np.maximum.at(img_flat, row[m] * width + col[m], cov[m])
+        else:
+            img_flat[row[m] * width + col[m]] = 1
+
+
+def rasterize_line(
+    x,
+    y,
+    width=800,
+    height=250,
+    aa: bool = True,
+    line_width_px: float = 1,
+    drawstyle: Literal[
+        "default", "steps", "steps-pre", "steps-mid", "steps-post"
+    ] = "default",
+    xlim: Optional[Tuple] = None,
+    ylim: Optional[Tuple] = None,
+    rgba: bool = True,
+    max_samples: int = 5_000_000,
+) -> np.ndarray:
+    """Rasterize a line chart directly with numpy, i.e., without any toolkit.
+
+    Aliased lines are rendered Bresenham-style and anti-aliased lines Wu-style, i.e.,
+    each pixel its intensity is determined by the stroke its coverage.
+
+    .. Note::
+        This rasterizer approximates (but is not pixel-identical to) the matplotlib
+        Agg output; it is intended for fast metric computation on large sweeps. On
+        M4-aggregated series (800x250 canvas, line widths 1-3), the alpha channel
+        its MAE w.r.t. :func:`return_matplotlib_arr` is at most 2 gray levels (2.6
+        and 8 for dense noise, aliased and anti-aliased), and the IoU of the drawn
+        pixels is at least 0.84; see the check in ``varia_toolkit_comparison.ipynb``.
+
+    parameters
+    ----------
+    x : array-like
+        x data
+    y : array-like
+        y data
+    width : int
+        width of the figure in pixels
+    height : int
+        height of the figure in pixels
+    aa : bool
+        whether to use anti-aliasing or not, defaults to True
+    line_width_px : float
+        width of the line in pixels
+    drawstyle : str
+        drawstyle of the line; must be one of the following:
+        'default', 'steps', 'steps-pre', 'steps-mid', 'steps-post'
+    xlim : tuple
+        x limits of the figure
+    ylim : tuple
+        y limits of the figure
+    rgba : bool
+        whether to return an RGBA uint8 array (black line, coverage as alpha) with
+        the same layout as :func:`return_matplotlib_arr`, defaults to True. If False,
+        the (height, width) float32 coverage in [0, 1] is returned.
+    max_samples : int
+        the maximum number of samples that are rasterized at once, which bounds the
+        memory usage
+
+    """
+    x_datetime, x_tz = _is_datetime(x), getattr(getattr(x, "dtype", None), "tz", None)
+    x_arr = _to_float_arr(x, x_datetime)
+    y_arr = _to_float_arr(y)
+    if xlim is not None:
+        xlim = _to_float_arr(xlim, x_datetime, x_tz)
+    xlim = _nonsingular((x_arr[0], x_arr[-1]) if xlim is None else xlim)
+    ylim = _nonsingular((np.nanmin(y_arr), np.nanmax(y_arr)) if ylim is None else ylim)
+    vx, vy = _get_line_vertices(x_arr, y_arr, drawstyle)
+
+    # Map the data to (continuous) pixel coordinates; the y-axis is flipped
+    px = (vx - xlim[0]) / (xlim[1] - xlim[0]) * width
+    py = height - (vy - ylim[0]) / (ylim[1] - ylim[0]) * height
+
+    img = np.zeros((height, width), dtype=np.float32)
+    if len(px) == 1:
+        px, py = np.repeat(px, 2), np.repeat(py, 2)
+    # Segments which have a NaN vertex are not drawn (i.e., a gap)
+    seg_idx = np.flatnonzero(np.isfinite(px[:-1] + py[:-1] + px[1:] + py[1:]))
+    # Process the segments in chunks with a bounded number of samples
+    seg_len = (
+        np.minimum(
+            np.maximum(np.abs(np.diff(px)), np.abs(np.diff(py)))[seg_idx],
+            width + height,
+        )
+        + 2
+    )
+    chunk_id = (np.cumsum(seg_len) // max_samples).astype(np.int64)
+    for idx in np.split(seg_idx, np.flatnonzero(np.diff(chunk_id)) + 1):
+        if len(idx):
+            _rasterize_segments(
+                img, px[idx], py[idx], px[idx + 1], py[idx + 1], line_width_px, aa
+            )
+
+    if not rgba:
+        return img
+    arr = np.zeros((height, width, 4), dtype=np.uint8)
+    arr[:, :, 3] = np.round(img * 255)
+    return arr
@@ -0,0 +1,306 @@
+"""Shared-memory store of (reference) images for parallel metric workers.
+
+The metric notebooks look up the reference images by their path string. When these
+images are held in a plain dict, every (forked) worker gradually copies the pages of
+the dict (as the reference counts of its objects are touched) and spawn-based
+platforms even pickle the full dict. The :class:`SharedImageStore` instead holds all
+images in a single contiguous (n_images, height, width, channels) block, backed by
+either ``multiprocessing.shared_memory`` or a memory-mapped ``.npy`` file, together
+with a path-to-slot index. Only the block name (or file path) and the index are
+pickled, and the workers attach to the block zero-copy.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import weakref
+from collections.abc import Mapping
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from .instrumentation import stage
+
+# The blocks that this process is attached to, i.e., {shm name or npy path:
+# (SharedMemory or None, read-only array)}, and the number of (open) stores per block
+_ATTACHED: Dict[str, Tuple[Optional[shared_memory.SharedMemory], np.ndarray]] = {}
+_N_ATTACHED: Dict[str, int] = {}
+
+
+def read_reference_img(path: str | Path, invert: bool = False) -> np.ndarray:
+    """Read a PNG figure as float32 array in [0, 255], as the metric notebooks do.
+
+    If `invert` is True, ``255 - 255 * img`` is returned (i.e., for the plotly and
+    bokeh figures, which have a white background).
+    """
+    with stage("png.decode") as st:
+        img = 255 * plt.imread(path)
+        if st:
+            st.add_bytes(read=os.path.getsize(path))
+    return (255 - img if invert else img).astype(np.float32)
+
+
+class SharedImageStore(Mapping):
+    """Read-only, dict-like store of equally-shaped images in shared memory.
+
+    Example
+    -------
+    >>> ref_store = SharedImageStore.from_paths(
+    ...     (figure_root_dir / "plotly").glob("reference_*.png"), invert=True
+    ... )
+    >>> with ref_store, Pool(processes=8) as pool:  # the workers attach to the block
+    ...     pool.map(partial(compute_dssim_plotly, ref_dict=ref_store, mse=True), files)
+
+    The block is freed when the owning store exits its context (or is unlinked).
+
+    """
+
+    def __init__(
+        self,
+        index: Dict[str, int],
+        shape: Tuple[int, ...],
+        dtype=np.float32,
+        shm_name: Optional[str] = None,
+        npy_path: Optional[str | Path] = None,
+    ):
+        """
+        Parameters
+        ----------
+        index : Dict[str, int]
+            The path-to-slot index, i.e., the position of each image in the block.
+        shape : Tuple[int, ...]
+            The shape of the image block, i.e., (n_images, height, width, channels).
+        dtype : np.dtype, optional
+            The dtype of the images, by default np.float32.
+        shm_name : str, optional
+            The name of the shared memory block to attach to.
+        npy_path : str | Path, optional
+            The path of the ``.npy`` stack to memory-map, only used when no
+            `shm_name` is passed.
+
+        .. note::
+            Use :meth:`from_paths` or :meth:`from_arrays` to create a new store.
+
+        """
+        assert (shm_name is None) != (npy_path is None), "pass either shm or npy"
+        self._index = index
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        self._shm_name = shm_name
+        self._npy_path = None if npy_path is None else str(npy_path)
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._owner = False  # whether this store created (and thus unlinks) it
+        self._attach()
+
+    @property
+    def _key(self) -> str:
+        return self._shm_name or self._npy_path
+
+    def _attach(self):
+        # NOTE: a worker attaches to each block once, even when the store is
+        # unpickled for every task (e.g., when passed via a `functools.partial`);
+        # the block is only detached when all of these stores are closed
+        key = self._key
+        if key not in _ATTACHED:
+            shm = None
+            if self._shm_name is not None:
+                shm = shared_memory.SharedMemory(name=self._shm_name)
+                if sys.version_info < (3, 13):
+                    # Prevent the resource tracker from unlinking the block when an
+                    # attaching (worker) process exits; only the owner unlinks it
+                    resource_tracker.unregister(shm._name, "shared_memory")
+                # NOTE: unlike np.ndarray(buffer=...), np.frombuffer holds an export
+                # of the mapping, so that the mapping cannot be closed while it (or a
+                # view of it) is alive
+                count = int(np.prod(self._shape))
+                arr = np.frombuffer(shm.buf, self._dtype, count).reshape(self._shape)
+            else:
+                arr = np.load(self._npy_path, mmap_mode="r")
+            arr.flags.writeable = False
+            _ATTACHED[key] = shm, arr
+        _N_ATTACHED[key] = _N_ATTACHED.get(key, 0) + 1
+        self._shm, self._arr = _ATTACHED[key]
+        assert self._arr.shape == self._shape and self._arr.dtype == self._dtype
+
+    @classmethod
+    def _create(
+        cls,
+        keys: List[str],
+        images: Iterator[np.ndarray],
+        npy_path: Optional[str | Path] = None,
+    ) -> SharedImageStore:
+        """Allocate the block for `keys` and fill it with the `images` one by one."""
+        assert len(keys), "no images were passed"
+        assert len(set(keys)) == len(keys), "the image paths must be unique"
+        first = np.asarray(next(images))
+        shape = (len(keys), *first.shape)
+        index = {k: i for i, k in enumerate(keys)}
+
+        shm = None
+        if npy_path is not None:
+            out = np.lib.format.open_memmap(
+                npy_path, mode="w+", dtype=first.dtype, shape=shape
+            )
+        else:
+            size = max(int(np.prod(shape)) * first.itemsize, 1)
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            out = np.ndarray(shape, dtype=first.dtype, buffer=shm.buf)
+        out[0] = first
+        for i, img in enumerate(images, start=1):
+            assert img.shape == first.shape, "all images must have the same shape"
+            out[i] = img
+
+        if shm is None:
+            out.flush()
+            del out
+            return cls(index, shape, first.dtype, npy_path=npy_path)
+        del out
+        store = cls(index, shape, first.dtype, shm_name=shm.name)
+        if sys.version_info < (3, 13):  # the block was unregistered by `_attach`
+            resource_tracker.register(shm._name, "shared_memory")
+        store._owner = True
+        shm.close()  # the store holds its own handle to the block
+        return store
+
+    @classmethod
+    def from_arrays(
+        cls,
+        arrays: Iterable[Tuple[str | Path, np.ndarray]],
+        npy_path: Optional[str | Path] = None,
+    ) -> SharedImageStore:
+        """Create a store from ``(path, image)`` tuples.
+
+        Parameters
+        ----------
+        arrays : Iterable[Tuple[str | Path, np.ndarray]]
+            The images, which must all have the same shape and dtype, keyed by their
+            path.
+        npy_path : str | Path, optional
+            If passed, the images are written to a ``.npy`` stack at this path which
+            is memory-mapped, instead of to a shared memory block.
+
+        """
+        items = list(arrays)
+        return cls._create(
+            [str(p) for p, _ in items], (a for _, a in items), npy_path=npy_path
+        )
+
+    @classmethod
+    def from_paths(
+        cls,
+        paths: Iterable[str | Path],
+        loader: Optional[Callable[[str | Path], np.ndarray]] = None,
+        npy_path: Optional[str | Path] = None,
+        **kwargs,
+    ) -> SharedImageStore:
+        """Create a store by reading the images at `paths`.
+
+        The `loader` defaults to :func:`read_reference_img`, to which the `kwargs`
+        (e.g., ``invert=True``) are passed. The images are read one by one, so that
+        only the shared block (and a single image) is held in memory.
+        """
+        if loader is None:
+
+            def loader(p):
+                return read_reference_img(p, **kwargs)
+
+        paths = list(paths)
+        return cls._create(
+            [str(p) for p in paths], (loader(p) for p in paths), npy_path=npy_path
+        )
+
+    def __getitem__(self, path: str | Path) -> np.ndarray:
+        """Return a read-only (zero-copy) view of the image at `path`.
+
+        The views keep the shared memory block mapped, i.e., the store cannot be
+        closed while they are alive; copy the image if it should outlive the store.
+        """
+        if self._arr is None:
+            raise ValueError("the store is closed")
+        return self._arr[self._index[str(path)]]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, path) -> bool:
+        return str(path) in self._index
+
+    @property
+    def nbytes(self) -> int:
+        return self._arr.nbytes
+
+    def __getstate__(self) -> dict:
+        # Only the block its name (or path) and the index are pickled
+        return dict(
+            index=self._index,
+            shape=self._shape,
+            dtype=self._dtype.str,
+            shm_name=self._shm_name,
+            npy_path=self._npy_path,
+        )
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    def close(self):
+        """Close this store; the last open store of a block detaches this process.
+
+        Raises
+        ------
+        BufferError
+            If this is the last open store of a shared memory block while views of
+            its images are still alive (as these would outlive the mapping). The
+            store then remains open.
+
+        """
+        if self._arr is None:
+            return
+        key = self._key
+        if _N_ATTACHED[key] == 1 and self._shm is not None:
+            # NOTE: all views reference the flat block (i.e., the base of the array),
+            # hence the block outlives the references that are dropped here iff a view
+            # is still alive
+            shm, block = self._shm, weakref.ref(self._arr.base)
+            self._arr = self._shm = None
+            del _ATTACHED[key]
+            if block() is not None:
+                arr = block().reshape(self._shape)
+                arr.flags.writeable = False
+                _ATTACHED[key] = self._shm, self._arr = shm, arr
+                raise BufferError(
+                    "cannot close the store while views of its images are alive; "
+                    "copy the images that should outlive the store"
+                )
+            shm.close()
+        _N_ATTACHED[key] -= 1
+        if not _N_ATTACHED[key]:
+            del _N_ATTACHED[key]
+            _ATTACHED.pop(key, None)
+        self._arr = self._shm = None
+
+    def unlink(self):
+        """Detach and free the shared memory block (or remove the ``.npy`` stack)."""
+        name, npy_path = self._shm_name, self._npy_path
+        self.close()
+        if name is not None:
+            shm = shared_memory.SharedMemory(name=name)
+            shm.close()
+            shm.unlink()  # also unregisters the block from the resource tracker
+        elif npy_path is not None:
+            Path(npy_path).unlink(missing_ok=True)
+
+    def __enter__(self) -> SharedImageStore:
+        return self
+
+    def __exit__(self, *args):
+        if self._owner:
+            self.unlink()
+        else:
+            self.close()
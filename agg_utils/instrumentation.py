@@ -0,0 +1,414 @@
+"""Opt-in instrumentation of the hot paths, i.e., per-stage timings and I/O volumes.
+
+The public functions of the hot paths are wrapped in named stages, e.g.,
+``aggregate``, ``parquet.read``, ``render.matplotlib``, ``png.encode``,
+``png.decode``, ``ssim``, or ``mask``. Once enabled, each stage records its number
+of calls, its cumulative time, a (log-spaced) histogram of its call durations (from
+which the percentiles are estimated), and the bytes it read or wrote.
+
+>>> from agg_utils import instrumentation
+>>> instrumentation.enable()
+>>> scheduler.run()  # or any other sweep, e.g., `compute_stability_grid`
+>>> print(instrumentation.summary())
+>>> instrumentation.dump("timings.json")
+
+.. note::
+    * When disabled (the default), an instrumented function only checks a global
+      flag before calling the wrapped function.
+    * The stage timings are inclusive; e.g., the ``render.matplotlib`` time of
+      ``construct_matplotlib_fig`` includes its nested ``png.encode`` time. A stage
+      which is (re-)entered within itself (e.g., a nested aggregation) is only
+      timed once.
+    * The ``png.encode`` stage of ``savefig`` and of the plotly & bokeh exports
+      includes their drawing (in the browser), as these are a single call.
+    * The ``multiprocessing`` workers flush their stats to a shared directory when
+      they exit (e.g., on ``Pool.close`` and ``join``), which :func:`summary` merges
+      with the stats of the current process. As terminated workers (e.g., on
+      ``Pool.terminate``, which a ``with Pool(...)`` block calls on exit) do not,
+      the task functions that are wrapped by :func:`worker_task` flush after each
+      task. Forked workers start with empty stats, and spawned workers are enabled
+      via the ``AGG_UTILS_INSTRUMENT(_DIR)`` environment variables, which are set
+      by :func:`enable`.
+
+"""
+
+from __future__ import annotations
+
+import atexit
+import functools
+import json
+import math
+import multiprocessing.util
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, TypeVar
+
+import numpy as np
+import pandas as pd
+
+__all__ = [
+    "enable",
+    "disable",
+    "is_enabled",
+    "reset",
+    "instrumented",
+    "stage",
+    "worker_task",
+    "flush",
+    "summary",
+    "dump",
+]
+
+F = TypeVar("F", bound=Callable)
+
+# The duration histogram has log-spaced bins of 1µs up to 10^4s, i.e., a relative
+# bin width of ~12%; shorter (longer) durations end up in the first (last) bin
+_HIST_MIN_S = 1e-6
+_HIST_BINS_PER_DECADE = 20
+_HIST_N_BINS = 10 * _HIST_BINS_PER_DECADE
+
+_ENV_ENABLED = "AGG_UTILS_INSTRUMENT"
+_ENV_DIR = "AGG_UTILS_INSTRUMENT_DIR"
+
+
+class _StageStats:
+    """The stats of a stage, which can be merged across processes."""
+
+    __slots__ = (
+        "calls",
+        "total_s",
+        "min_s",
+        "max_s",
+        "hist",
+        "bytes_read",
+        "bytes_written",
+    )
+
+    def __init__(self):
+        self.calls = 0
+        self.total_s = 0.0
+        self.min_s = math.inf
+        self.max_s = 0.0
+        self.hist = [0] * _HIST_N_BINS
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add_time(self, dt: float):
+        self.calls += 1
+        self.total_s += dt
+        self.min_s = min(self.min_s, dt)
+        self.max_s = max(self.max_s, dt)
+        b = int(math.log10(max(dt, _HIST_MIN_S) / _HIST_MIN_S) * _HIST_BINS_PER_DECADE)
+        self.hist[min(b, _HIST_N_BINS - 1)] += 1
+
+    def merge(self, other: _StageStats):
+        self.calls += other.calls
+        self.total_s += other.total_s
+        self.min_s = min(self.min_s, other.min_s)
+        self.max_s = max(self.max_s, other.max_s)
+        self.hist = [a + b for a, b in zip(self.hist, other.hist)]
+        self.bytes_read += other.bytes_read
+        self.bytes_written += other.bytes_written
+
+    def percentile(self, q: float) -> float:
+        """Estimate the `q`-th percentile as the geometric center of its bin."""
+        if not self.calls:
+            return math.nan
+        b = int(np.searchsorted(np.cumsum(self.hist), q / 100 * self.calls))
+        b = min(b, _HIST_N_BINS - 1)
+        center = _HIST_MIN_S * 10 ** ((b + 0.5) / _HIST_BINS_PER_DECADE)
+        return min(max(center, self.min_s), self.max_s)
+
+    def to_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> _StageStats:
+        stats = cls()
+        for k in cls.__slots__:
+            setattr(stats, k, d[k])
+        return stats
+
+
+class _State:
+    def __init__(self):
+        self.enabled = False
+        self.worker_dir: Optional[str] = None
+        self.stats: Dict[str, _StageStats] = {}
+
+
+_STATE = _State()
+_LOCK = threading.Lock()
+# The stages which are currently active in a thread (to detect re-entered stages)
+_ACTIVE = threading.local()
+
+
+def _get_stats(name: str) -> _StageStats:
+    stats = _STATE.stats.get(name)
+    if stats is None:
+        stats = _STATE.stats.setdefault(name, _StageStats())
+    return stats
+
+
+class _Stage:
+    """The context manager of an (enabled) stage."""
+
+    __slots__ = ("name", "_t0", "_nested")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> _Stage:
+        active = getattr(_ACTIVE, "stages", None)
+        if active is None:
+            active = _ACTIVE.stages = set()
+        self._nested = self.name in active
+        if not self._nested:
+            active.add(self.name)
+            self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if self._nested:
+            return
+        dt = time.perf_counter() - self._t0
+        _ACTIVE.stages.discard(self.name)
+        with _LOCK:
+            _get_stats(self.name).add_time(dt)
+
+    def __bool__(self) -> bool:
+        return True
+
+    def add_bytes(self, read: int = 0, written: int = 0):
+        """Add the number of bytes which were read / written to the stage."""
+        with _LOCK:
+            stats = _get_stats(self.name)
+            stats.bytes_read += int(read)
+            stats.bytes_written += int(written)
+
+
+class _NullStage:
+    """The (falsy) context manager of a disabled stage."""
+
+    __slots__ = ()
+
+    def __enter__(self) -> _NullStage:
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __bool__(self) -> bool:
+        return False
+
+    def add_bytes(self, read: int = 0, written: int = 0):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str):
+    """Return a context manager which times the enclosed block as stage `name`.
+
+    The returned object is falsy when the instrumentation is disabled, so that the
+    byte counts are only computed when they are recorded; e.g.,
+
+    >>> with stage("parquet.read") as st:
+    ...     df = pd.read_parquet(path)
+    ...     if st:
+    ...         st.add_bytes(read=os.path.getsize(path))
+
+    """
+    if not _STATE.enabled:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def instrumented(name: str) -> Callable[[F], F]:
+    """Decorate a function, so that its calls are timed as stage `name`."""
+
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _STATE.enabled:
+                return func(*args, **kwargs)
+            with _Stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def worker_task(func: F) -> F:
+    """Decorate a pool task function, so that the worker flushes its stats after
+    each task (see :func:`flush`)."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if _STATE.enabled:
+                flush()
+
+    return wrapper  # type: ignore[return-value]
+
+
+def _reset_after_fork():
+    # NOTE: a forked worker inherits the stats of its parent, which are already
+    # accounted for by the parent itself
+    _STATE.stats = {}
+    _ACTIVE.stages = set()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _register_exit_flush(*args):
+    # NOTE: the finalizers of a multiprocessing worker are run when it exits
+    # gracefully
+    multiprocessing.util.Finalize(None, _flush_if_enabled, exitpriority=0)
+
+
+def _flush_if_enabled():
+    if _STATE.enabled:
+        flush()
+
+
+# I.e., for each forked worker, as the finalizers of its parent are cleared
+multiprocessing.util.register_after_fork(_STATE, _register_exit_flush)
+
+
+def enable(worker_dir: Optional[str | Path] = None, report_path=None):
+    """Enable the instrumentation (of this process and its future workers).
+
+    Parameters
+    ----------
+    worker_dir : str | Path, optional
+        The directory to which the pool workers flush their stats, by default None.
+        If None, a temporary directory is created.
+    report_path : str | Path, optional
+        If passed, the stats are dumped (see :func:`dump`) to this path when the
+        current process exits.
+
+    """
+    if worker_dir is None:
+        worker_dir = tempfile.mkdtemp(prefix="agg_utils_instrument_")
+    os.makedirs(worker_dir, exist_ok=True)
+    _STATE.worker_dir = str(worker_dir)
+    _STATE.enabled = True
+    os.environ[_ENV_ENABLED] = "1"
+    os.environ[_ENV_DIR] = _STATE.worker_dir
+    if report_path is not None:
+        atexit.register(dump, report_path)
+
+
+def disable():
+    """Disable the instrumentation; the recorded stats are retained."""
+    _STATE.enabled = False
+    os.environ.pop(_ENV_ENABLED, None)
+
+
+def is_enabled() -> bool:
+    return _STATE.enabled
+
+
+def reset(remove_worker_dir: bool = False):
+    """Clear the stats of this process and those flushed by the workers."""
+    with _LOCK:
+        _STATE.stats = {}
+    worker_dir = _STATE.worker_dir
+    if worker_dir is not None and os.path.isdir(worker_dir):
+        if remove_worker_dir:
+            shutil.rmtree(worker_dir, ignore_errors=True)
+            _STATE.worker_dir = None
+        else:
+            for f in Path(worker_dir).glob("*.json"):
+                f.unlink(missing_ok=True)
+
+
+def flush():
+    """Write the (cumulative) stats of this process to the worker directory."""
+    if _STATE.worker_dir is None:
+        return
+    with _LOCK:
+        data = {name: s.to_dict() for name, s in _STATE.stats.items()}
+    path = Path(_STATE.worker_dir) / f"{os.getpid()}.json"
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _collect() -> Dict[str, _StageStats]:
+    """Merge the stats of this process with those flushed by the (other) workers."""
+    merged: Dict[str, _StageStats] = {}
+
+    def _merge(stats_dict: Dict[str, _StageStats]):
+        for name, stats in stats_dict.items():
+            merged.setdefault(name, _StageStats()).merge(stats)
+
+    with _LOCK:
+        _merge(_STATE.stats)
+    if _STATE.worker_dir is not None and os.path.isdir(_STATE.worker_dir):
+        for path in Path(_STATE.worker_dir).glob("*.json"):
+            if path.stem == str(os.getpid()):
+                continue  # i.e., an in-process run of a worker task
+            with open(path) as f:
+                data = json.load(f)
+            _merge({k: _StageStats.from_dict(v) for k, v in data.items()})
+    return merged
+
+
+def summary() -> pd.DataFrame:
+    """Return the stats of all stages, sorted on their cumulative time.
+
+    The `total_s` is summed over all processes (i.e., the CPU time of the stage),
+    while the percentiles are estimated from the duration histograms.
+    """
+    rows = []
+    for name, s in _collect().items():
+        if not s.calls and not (s.bytes_read or s.bytes_written):
+            continue
+        rows.append(
+            {
+                "stage": name,
+                "calls": s.calls,
+                "total_s": s.total_s,
+                "mean_ms": 1e3 * s.total_s / s.calls if s.calls else math.nan,
+                "p50_ms": 1e3 * s.percentile(50),
+                "p90_ms": 1e3 * s.percentile(90),
+                "p99_ms": 1e3 * s.percentile(99),
+                "max_ms": 1e3 * s.max_s if s.calls else math.nan,
+                "bytes_read": s.bytes_read,
+                "bytes_written": s.bytes_written,
+            }
+        )
+    columns = ["stage", "calls", "total_s", "mean_ms", "p50_ms", "p90_ms", "p99_ms"]
+    columns += ["max_ms", "bytes_read", "bytes_written"]
+    df = pd.DataFrame(rows, columns=columns)
+    return df.sort_values("total_s", ascending=False).set_index("stage")
+
+
+def dump(path: str | Path):
+    """Dump the :func:`summary` to a JSON (``.json``) or a CSV file (otherwise)."""
+    df = summary()
+    if str(path).endswith(".json"):
+        with open(path, "w") as f:
+            json.dump(df.reset_index().to_dict(orient="records"), f, indent=1)
+    else:
+        df.to_csv(path)
+
+
+# Enable the instrumentation of (spawned) workers, see `enable`
+if os.environ.get(_ENV_ENABLED) == "1":
+    enable(os.environ.get(_ENV_DIR))
+    # NOTE: the finalizers (and after-fork hooks) of a spawned worker are not reset
+    _register_exit_flush()
@@ -0,0 +1,192 @@
+"""In-memory render -> metric pipeline, i.e., without any PNG round trip.
+
+The notebook flow writes all figures to disk (``0.3_Fig_construction.ipynb``), after
+which ``0.4_Fig_metrics.ipynb`` parses the figure metadata back out of the file names
+and re-reads the images. The :func:`iter_metric_rows` pipeline instead renders each
+(aggregated and reference) figure in memory, computes its metrics right away, and
+yields a row per figure. The figure metadata is passed as a structured
+:class:`FigureSpec` and writing the PNGs is optional.
+
+Example
+-------
+>>> jobs = (
+...     (FigureSpec(data, n, n_out, agg, lw, ls, aa), get_series(agg, data, n, n_out))
+...     for (data, agg, n, n_out), lw, ls, aa in itertools.product(
+...         agg_keys, [1, 2, 3, 4], ["default", "steps-mid"], [True, False]
+...     )
+... )
+>>> references = {(d, n): get_series("reference", d, n) for d, _, n, _ in agg_keys}
+>>> df_metrics = pd.DataFrame(iter_metric_rows(jobs, references, mse=True))
+
+"""
+
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Mapping, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .data_hepers import get_png_path
+from .fig_construction import _write_png, return_matplotlib_arr
+from .metrics import SSIMEngine, compute_img_metrics
+
+
+class FigureSpec(NamedTuple):
+    """The structured metadata of a figure; i.e., the fields of `get_png_path`."""
+
+    data: str
+    n: int
+    n_out: Optional[int]
+    aggregator: str
+    line_width: int = 1
+    line_shape: str = "default"
+    aa: bool = False
+    toolkit: str = "matplotlib"
+
+    def reference(self, line_width: Optional[int] = None) -> FigureSpec:
+        """Return the spec of the reference figure (with the given `line_width`)."""
+        lw = self.line_width if line_width is None else line_width
+        return self._replace(aggregator="reference", n_out=None, line_width=lw)
+
+    @property
+    def png_path(self) -> Path:
+        return get_png_path(**self._asdict())
+
+    def to_series(self) -> pd.Series:
+        """Return the metadata columns, as output by e.g. `compute_dssim_matplotlib`."""
+        return pd.Series(
+            index=["toolkit", "data", "aggregator", "n", "n_out", "ls", "lw", "aa"],
+            data=[
+                self.toolkit,
+                self.data,
+                self.aggregator,
+                self.n,
+                self.n_out,
+                self.line_shape,
+                self.line_width,
+                self.aa,
+            ],
+        )
+
+
+def _render(
+    spec: FigureSpec,
+    series,
+    xlim: Tuple,
+    ylim: Tuple,
+    renderer: Callable[..., np.ndarray],
+    save_png: bool,
+    **render_kwargs,
+) -> np.ndarray:
+    """Render the `series` as specified in memory (and optionally save it as PNG)."""
+    arr = renderer(
+        series.index,
+        np.asarray(series.values).ravel(),
+        aa=spec.aa,
+        line_width_px=spec.line_width,
+        drawstyle=spec.line_shape,
+        xlim=xlim,
+        ylim=ylim,
+        **render_kwargs,
+    )
+    if save_png:
+        path = spec.png_path
+        os.makedirs(path.parent, exist_ok=True)
+        _write_png(path, arr)
+    return arr.astype(np.float32)
+
+
+def iter_metric_rows(
+    jobs: Iterable[Tuple[FigureSpec, pd.Series]],
+    references: Mapping[Tuple[str, int], pd.Series],
+    mse: bool = True,
+    save_png: bool = False,
+    renderer: Callable[..., np.ndarray] = return_matplotlib_arr,
+    dim: int = 3,
+    max_cached_refs: int = 64,
+    render_kwargs: Optional[dict] = None,
+    **ssim_kwargs,
+) -> Iterator[pd.Series]:
+    """Render the figures of the `jobs` in memory and yield their metrics.
+
+    For each ``(spec, series)`` job, the aggregated `series` and its (line width 1
+    and same line width) reference figures are rendered with the x- and y-range of
+    the reference series. The reference figures are rendered once and kept in an
+    LRU cache, so ordering the jobs per reference (i.e., per data, n, line shape, and
+    aa) avoids re-rendering them.
+
+    parameters
+    ----------
+    jobs : Iterable[Tuple[FigureSpec, pd.Series]]
+        the spec of each figure, together with its aggregated series (or
+        :class:`data_hepers.SeriesArrays`)
+    references : Mapping[Tuple[str, int], pd.Series]
+        the reference series, keyed by their (data, n)
+    mse : bool
+        whether to compute the MSE (and MAE) metrics as well, defaults to True
+    save_png : bool
+        whether to write the rendered figures to their `FigureSpec.png_path`, i.e.,
+        where ``0.3_Fig_construction.ipynb`` would save them, defaults to False
+    renderer : Callable[..., np.ndarray]
+        the in-memory renderer, which must accept the `return_matplotlib_arr`
+        keyword arguments and return an RGBA uint8 array; e.g.,
+        :func:`fig_construction.rasterize_line`. Defaults to `return_matplotlib_arr`.
+    dim : int
+        the channel of the images which is compared, defaults to 3 (i.e., alpha)
+    max_cached_refs : int
+        the maximum number of cached reference images, defaults to 64
+    render_kwargs : dict, optional
+        additional keyword arguments for the `renderer`, e.g., the width and height
+    ssim_kwargs : dict
+        keyword arguments for the skimage.metrics.structural_similarity function
+
+    returns
+    -------
+    Iterator[pd.Series]
+        per job, the metadata columns followed by the `compute_img_metrics` metrics
+
+    .. Note::
+        The plotly and bokeh figures can only be rendered via a browser (i.e.,
+        kaleido or selenium) and thus are not supported by this pipeline.
+
+    """
+    render_kwargs = render_kwargs or {}
+    ref_imgs: OrderedDict = OrderedDict()
+    # The SSIM moments of the references are cached (under their spec) by a dedicated
+    # engine, as the reference images of equal specs differ between calls (e.g., other
+    # renderers); hence, these are freed together with this generator
+    engine = SSIMEngine()
+
+    def _get_ref_img(spec: FigureSpec, ref: pd.Series, lims) -> np.ndarray:
+        if spec in ref_imgs:
+            ref_imgs.move_to_end(spec)
+            return ref_imgs[spec]
+        img = _render(spec, ref, *lims, renderer, save_png, **render_kwargs)
+        ref_imgs[spec] = img
+        if len(ref_imgs) > max_cached_refs:
+            ref_imgs.popitem(last=False)
+        return img
+
+    for spec, series in jobs:
+        ref = references[(spec.data, spec.n)]
+        xlim = (ref.index[0], ref.index[-1])
+        ylim = (np.nanmin(ref.values), np.nanmax(ref.values))
+
+        ref_spec_lw1, ref_spec_same_lw = spec.reference(1), spec.reference()
+        ref_lw1 = _get_ref_img(ref_spec_lw1, ref, (xlim, ylim))
+        ref_same_lw = _get_ref_img(ref_spec_same_lw, ref, (xlim, ylim))
+        agg = _render(spec, series, xlim, ylim, renderer, save_png, **render_kwargs)
+
+        ref_keys = (ref_spec_lw1, ref_spec_same_lw)
+        yield pd.concat(
+            [
+                spec.to_series(),
+                compute_img_metrics(
+                    agg, ref_lw1, ref_same_lw, dim, mse, ref_keys, engine, **ssim_kwargs
+                ),
+            ]
+        )
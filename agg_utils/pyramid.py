@@ -0,0 +1,225 @@
+"""Multi-resolution min/max pyramid index for fast M4 / MinMax re-aggregation.
+
+The pyramid stores, for every level k, the (first) argmin and argmax position of each
+aligned block of 2**k samples (the first and last position of a block are implicit).
+Any [start, end) window can then be decomposed into O(log n) blocks, allowing to
+compute the M4 (or MinMax) aggregation of the window for any `n_out` in
+O(n_out * log n), instead of the O(n) pass of :meth:`M4Aggregator._aggregate`.
+
+This is especially useful for the pan & zoom access pattern (see the visual stability
+notebook), where many (overlapping) windows of the same series are aggregated.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from .aggregators import (
+    _get_index_arr,
+    _get_m4_bins,
+    _get_values_arr,
+    _is_better,
+    _take,
+)
+from .instrumentation import instrumented
+
+
+class PyramidIndex:
+    """Power-of-two block pyramid of argmin and argmax positions for a series.
+
+    Example
+    -------
+    >>> idx = PyramidIndex(s)
+    >>> idx.aggregate(n_out=1000, start=50_000, end=250_000)
+    ... # identical to M4Aggregator()._aggregate(s.iloc[50_000:250_000], 1000)
+
+    """
+
+    _ufuncs = (np.less, np.greater)
+
+    def __init__(self, s: pd.Series, levels: List[List[np.ndarray]] = None):
+        """
+        Parameters
+        ----------
+        s : pd.Series
+            The series (with a sorted index) on which the pyramid is built.
+        levels : List[List[np.ndarray]], optional
+            The precomputed argmin & argmax levels, by default None. If None, the
+            pyramid is constructed from `s`. This argument is used by :meth:`load`.
+
+        """
+        self.s = s
+        self._s_i = _get_index_arr(s)
+        self._values = _get_values_arr(s)
+        # The precision that we need to store the positions
+        self._pos_dtype = np.int32 if len(s) < np.iinfo(np.int32).max else np.int64
+        self._levels = self._build() if levels is None else levels
+
+    def _build(self) -> List[List[np.ndarray]]:
+        # NOTE: the first level (block size 1) is the identity and thus not stored
+        levels = [[], []]
+        for k, ufunc in enumerate(self._ufuncs):
+            prev = np.arange(len(self._values), dtype=self._pos_dtype)
+            while len(prev) > 1:
+                left, right = prev[: len(prev) // 2 * 2 : 2], prev[1::2]
+                # On ties, the left (i.e., first) position is retained
+                right_better = _is_better(
+                    self._values[right], self._values[left], ufunc
+                )
+                prev = np.where(right_better, right, left)
+                levels[k].append(prev)
+        return levels
+
+    def _node(self, k: int, level: int, node: np.ndarray) -> np.ndarray:
+        if level == 0:
+            return node
+        return self._levels[k][level - 1][node]
+
+    def _range_arg(self, k: int, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+        """Compute the (first) arg-extremum of each [lo, hi) range.
+
+        This is a vectorized bottom-up segment tree query over all ranges.
+        """
+        ufunc, v = self._ufuncs[k], self._values
+        # Accumulators for the nodes that are taken from the left & right side
+        # (-1 indicates that the accumulator is still empty)
+        left, right = np.full(len(lo), -1), np.full(len(lo), -1)
+        lo, hi = lo.astype(np.int64), hi.astype(np.int64)
+        level = 0
+        while True:
+            active = lo < hi
+            if not active.any():
+                break
+            m = np.flatnonzero(active & (lo & 1 == 1))
+            cand = self._node(k, level, lo[m])
+            # the left side nodes are taken in increasing position order
+            upd = (left[m] < 0) | _is_better(v[cand], v[left[m]], ufunc)
+            left[m[upd]] = cand[upd]
+            lo[m] += 1
+
+            m = np.flatnonzero(active & (hi & 1 == 1))
+            hi[m] -= 1
+            cand = self._node(k, level, hi[m])
+            # the right side nodes are taken in decreasing position order
+            upd = (right[m] < 0) | ~_is_better(v[right[m]], v[cand], ufunc)
+            right[m[upd]] = cand[upd]
+
+            lo >>= 1
+            hi >>= 1
+            level += 1
+
+        use_right = (right >= 0) & ((left < 0) | _is_better(v[right], v[left], ufunc))
+        return np.where(use_right, right, left)
+
+    def aggregate(
+        self, n_out: int, start: int = 0, end: int = None, minmax: bool = False
+    ) -> pd.Series:
+        """Aggregate the [start, end) window of the series.
+
+        Parameters
+        ----------
+        n_out : int
+            The number of output points.
+        start : int, optional
+            The (positional) start of the window, by default 0.
+        end : int, optional
+            The (positional, exclusive) end of the window, by default None.
+            If None, the end of the series is used.
+        minmax : bool, optional
+            Whether to return the :class:`RangeMinMaxAggregator` output instead of
+            the :class:`M4Aggregator` output, by default False.
+
+        Returns
+        -------
+        pd.Series
+            The aggregated series, identical to
+            ``M4Aggregator()._aggregate(s.iloc[start:end], n_out)``.
+
+        """
+        return self.aggregate_n_out_grid([n_out], start, end, minmax)[n_out]
+
+    @instrumented("aggregate")
+    def aggregate_n_out_grid(
+        self,
+        n_out_grid: Iterable[int],
+        start: int = 0,
+        end: int = None,
+        minmax: bool = False,
+    ) -> Dict[int, pd.Series]:
+        """Aggregate the [start, end) window for each `n_out` in one batched query.
+
+        See :meth:`aggregate` for the parameters; the bins of all `n_out` values
+        are queried at once, which avoids the per-query overhead.
+
+        Returns
+        -------
+        Dict[int, pd.Series]
+            A dict with the `n_out` as key and the aggregated series as value.
+
+        """
+        n_per_bin = 2 if minmax else 4
+        end = len(self.s) if end is None else end
+        assert 0 <= start < end <= len(self.s)
+        s_i = self._s_i[start:end]
+
+        n_out_grid = [int(n_out) for n_out in n_out_grid]
+        bins_list = []
+        for n_out in n_out_grid:
+            assert n_out % n_per_bin == 0, f"n_out must be a multiple of {n_per_bin}"
+            bins_list.append(_get_m4_bins(s_i, n_out // n_per_bin) + start)
+        lo = np.concatenate([bins[:-1] for bins in bins_list])
+        hi = np.concatenate([bins[1:] for bins in bins_list])
+
+        argmin, argmax = self._range_arg(0, lo, hi), self._range_arg(1, lo, hi)
+        if np.isnan(self._values[argmin]).any():
+            raise ValueError("Encountered a bin with all NA values")
+
+        out = {}
+        split = np.cumsum([len(bins) - 1 for bins in bins_list])[:-1]
+        for n_out, bins, argmin_, argmax_ in zip(
+            n_out_grid, bins_list, np.split(argmin, split), np.split(argmax, split)
+        ):
+            if minmax:
+                idxs = np.concatenate((argmin_, argmax_))
+            else:
+                idxs = np.concatenate((bins[:-1], argmin_, argmax_, bins[1:] - 1))
+            # NOTE: we do not use the np.unique so that all indices are retained
+            out[n_out] = _take(self.s, np.sort(idxs, kind="stable"))
+        return out
+
+    def aggregate_x_range(
+        self, n_out: int, x_start, x_end, minmax: bool = False
+    ) -> pd.Series:
+        """Aggregate the window of index values within [x_start, x_end]."""
+        start = self.s.index.searchsorted(x_start, side="left")
+        end = self.s.index.searchsorted(x_end, side="right")
+        return self.aggregate(n_out, start, end, minmax=minmax)
+
+    @staticmethod
+    def get_index_path(pqt_path: str | Path) -> Path:
+        """Return the path of the pyramid index which accompanies a Parquet file."""
+        return Path(pqt_path).with_suffix(".pyramid.npz")
+
+    def save(self, path: str | Path):
+        """Serialize the pyramid levels (e.g., alongside the Parquet data)."""
+        arrs = {
+            f"{k}_{level}": arr
+            for k, levels in enumerate(self._levels)
+            for level, arr in enumerate(levels)
+        }
+        np.savez(path, n=len(self.s), n_levels=len(self._levels[0]), **arrs)
+
+    @classmethod
+    def load(cls, path: str | Path, s: pd.Series) -> PyramidIndex:
+        """Load a serialized pyramid for the series `s`."""
+        with np.load(path) as f:
+            assert int(f["n"]) == len(s), "the pyramid was built for another series"
+            levels = [
+                [f[f"{k}_{level}"] for level in range(int(f["n_levels"]))]
+                for k in range(2)
+            ]
+        return cls(s, levels=levels)
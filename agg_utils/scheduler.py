@@ -0,0 +1,483 @@
+"""Parallel experiment-grid scheduler with a resumable, content-addressed result cache.
+
+The experiment consists of three stages, which used to be hand-rolled sweeps in the
+notebooks (``0.2``, ``0.3`` & ``construct_bokeh_figs.py``, and ``0.4``):
+
+1. ``aggregate``: the (reference and) aggregated series of each (data, n,
+   aggregator, n_out) combination.
+2. ``render``: the figure of each (toolkit, data, n, n_out, aggregator, line width,
+   line shape, aa) combination, and of the corresponding reference.
+3. ``metrics``: the metrics of each aggregated figure w.r.t. its references.
+
+Each artifact is stored under a hash of its inputs; i.e., the dataset its content,
+the grid parameters, the hashes of the upstream artifacts, and the source code of the
+module that produces it. As such, rerunning the scheduler skips all completed work,
+resumes after a crash (the artifacts are written atomically), and recomputes exactly
+the artifacts whose inputs or code changed. The cache (and its :meth:`manifest`) is
+the source of truth for the downstream analyses, instead of the ``agg_data.csv``.
+
+Example
+-------
+>>> grid = ExperimentGrid(
+...     datasets={"btc": btc_series, "noise": hf_noise},
+...     n=[50_000, 200_000],
+...     n_out=np.arange(200, 4001, 20),
+...     aggregators=[M4Aggregator, MinMaxAggregator, LTTB, EveryNthPoint],
+...     toolkits=["matplotlib"],
+... )
+>>> scheduler = Scheduler(grid, figure_root_dir / "cache")
+>>> scheduler.run(processes=8)  # rerun to resume after a failure
+>>> df_metrics = scheduler.collect_metrics()
+
+"""
+
+from __future__ import annotations
+
+import hashlib
+import inspect
+import json
+import os
+import traceback
+from functools import lru_cache
+from multiprocessing import Pool
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
+
+import numpy as np
+import pandas as pd
+from plotly_resampler.aggregation import AbstractSeriesAggregator
+from tqdm.auto import tqdm
+
+from . import fig_construction, metrics
+from .data_hepers import read_series
+from .image_store import read_reference_img
+from .instrumentation import stage, worker_task
+from .pipeline import FigureSpec
+
+STAGES = ("aggregate", "render", "metrics")
+
+
+class ExperimentGrid(NamedTuple):
+    """Declarative grid of the experiment; the stages run over its product."""
+
+    datasets: Dict[str, pd.Series]
+    n: Sequence[int]
+    n_out: Sequence[int]
+    aggregators: Sequence[Type[AbstractSeriesAggregator]]
+    toolkits: Sequence[str] = ("matplotlib",)
+    line_widths: Sequence[int] = (1, 2, 3, 4)
+    # Either the line shapes of all toolkits, or a dict with the shapes per toolkit
+    # (e.g., plotly uses "linear" whereas matplotlib uses "default")
+    line_shapes: Union[Sequence[str], Dict[str, Sequence[str]]] = ("default",)
+    aa: Sequence[bool] = (True, False)
+
+    def get_line_shapes(self, toolkit: str) -> Sequence[str]:
+        if isinstance(self.line_shapes, dict):
+            return self.line_shapes[toolkit]
+        return self.line_shapes
+
+
+class Task(NamedTuple):
+    """A unit of work of a stage, which writes its artifact(s) to `outputs`."""
+
+    stage: str
+    params: dict
+    inputs: Dict[str, str]  # the paths of the upstream artifacts
+    outputs: Dict[str, str]  # the paths of the artifacts which are (re)computed
+
+
+def _hash(*parts) -> str:
+    payload = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.sha256(payload).hexdigest()[:24]
+
+
+@lru_cache(maxsize=None)
+def _code_version(obj) -> str:
+    """Hash the source of the module that defines `obj` (a module, class, ...)."""
+    module = obj if inspect.ismodule(obj) else inspect.getmodule(obj)
+    try:
+        return _hash(inspect.getsource(module))
+    except (OSError, TypeError):  # e.g., a compiled module
+        return _hash(getattr(module, "__name__", repr(obj)))
+
+
+def _fingerprint(s: pd.Series) -> str:
+    """Return a hash of the content (i.e., index and values) of a series."""
+    h = pd.util.hash_pandas_object(s, index=True).to_numpy()
+    return hashlib.sha256(h.tobytes()).hexdigest()[:24]
+
+
+def _atomic_write(path: str | Path, write: Callable[[str], None]):
+    """Write the artifact via `write` to a temporary file, and rename it to `path`.
+
+    As such, an interrupted task never leaves a (partial) artifact behind.
+    """
+    path = Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    # NOTE: the temporary file retains the suffix, e.g., for the savefig format
+    tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp{path.suffix}")
+    try:
+        write(str(tmp_path))
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+# ---------------------------------- STAGE TASKS ---------------------------------
+# The datasets of the worker processes (only used by the aggregate stage)
+_WORKER_DATASETS: Dict[str, pd.Series] = {}
+
+
+def _init_worker(datasets: Dict[str, pd.Series]):
+    global _WORKER_DATASETS
+    _WORKER_DATASETS = datasets
+
+
+def _write_series(s: pd.Series, path: str):
+    df = s.reset_index(drop=False)
+    df.columns = [str(c) for c in df.columns]  # e.g., the 0 of an unnamed series
+    with stage("parquet.write") as st:
+        df.to_parquet(path)
+        if st:
+            st.add_bytes(written=os.path.getsize(path))
+
+
+def _run_aggregate(task: Task):
+    p = task.params
+    s = _WORKER_DATASETS[p["data"]].iloc[: p["n"]]
+    if p["aggregator"] is None:  # the reference
+        _atomic_write(task.outputs["reference"], lambda path: _write_series(s, path))
+        return
+    agg = p["aggregator"]()
+    n_outs = [int(n_out) for n_out in task.outputs]
+    with stage("aggregate"):
+        if hasattr(agg, "_aggregate_n_out_grid"):
+            agg_dict = agg._aggregate_n_out_grid(s, n_outs)
+        else:
+            agg_dict = {n_out: agg._aggregate(s, n_out) for n_out in n_outs}
+    for n_out, path in task.outputs.items():
+        _atomic_write(path, lambda tmp: _write_series(agg_dict[int(n_out)], tmp))
+
+
+def _run_render(task: Task):
+    spec: FigureSpec = task.params["spec"]
+    s, ref = read_series(task.inputs["series"]), read_series(task.inputs["reference"])
+    kwargs = dict(
+        xlim=(ref.index[0], ref.index[-1]),
+        ylim=(np.nanmin(ref.values), np.nanmax(ref.values)),
+        aa=spec.aa,
+        **task.params["render_kwargs"],
+    )
+    x, y = s.index, s.values.ravel()
+    if spec.toolkit == "matplotlib":
+        kwargs.update(line_width_px=spec.line_width, drawstyle=spec.line_shape)
+        construct = fig_construction.construct_matplotlib_fig
+    else:
+        kwargs.update(line_width=spec.line_width, line_shape=spec.line_shape)
+        construct = getattr(fig_construction, f"construct_{spec.toolkit}_fig")
+    _atomic_write(task.outputs["png"], lambda path: construct(x, y, path, **kwargs))
+
+
+def _run_metrics(task: Task):
+    spec: FigureSpec = task.params["spec"]
+    # The plotly & bokeh figures have a white background (see `0.4_Fig_metrics`)
+    invert, dim = (False, 3) if spec.toolkit == "matplotlib" else (True, 1)
+    agg, ref_lw1, ref_same_lw = (
+        read_reference_img(task.inputs[k], invert=invert)
+        for k in ("png", "ref_lw1", "ref_same_lw")
+    )
+    ref_keys = (task.inputs["ref_lw1"], task.inputs["ref_same_lw"])
+    row = pd.concat(
+        [
+            spec.to_series(),
+            metrics.compute_img_metrics(
+                agg, ref_lw1, ref_same_lw, dim, task.params["mse"], ref_keys
+            ),
+        ]
+    )
+    _atomic_write(task.outputs["row"], row.to_pickle)
+
+
+_STAGE_FUNCS: Dict[str, Callable[[Task], None]] = {
+    "aggregate": _run_aggregate,
+    "render": _run_render,
+    "metrics": _run_metrics,
+}
+
+
+@worker_task
+def _run_batch(batch: List[Task]) -> List[Tuple[Task, Optional[str]]]:
+    """Run a batch of tasks, and return each task with its error (if any)."""
+    out = []
+    for task in batch:
+        try:
+            _STAGE_FUNCS[task.stage](task)
+            out.append((task, None))
+        except Exception:
+            out.append((task, traceback.format_exc()))
+    return out
+
+
+# ----------------------------------- SCHEDULER ----------------------------------
+class Scheduler:
+    """Run the stages of an :class:`ExperimentGrid` with a content-addressed cache.
+
+    The artifacts are stored at ``cache_dir / stage / key[:2] / key.<ext>``, where the
+    key hashes all inputs of the artifact (see the module docstring).
+    """
+
+    def __init__(
+        self,
+        grid: ExperimentGrid,
+        cache_dir: str | Path,
+        code_version: str = "",
+        mse: bool = True,
+        render_kwargs: Optional[dict] = None,
+    ):
+        """
+        Parameters
+        ----------
+        grid : ExperimentGrid
+            The grid of the experiment.
+        cache_dir : str | Path
+            The root directory of the result cache.
+        code_version : str, optional
+            An additional version (e.g., a git commit) which is included in all keys,
+            by default "". The source of the producing modules is always included.
+        mse : bool, optional
+            Whether the metrics stage computes the MSE (and MAE) as well, by default
+            True.
+        render_kwargs : dict, optional
+            Additional keyword arguments of the `construct_*_fig` functions, e.g., the
+            width and height of the figures.
+
+        """
+        self.grid = grid
+        self.cache_dir = Path(cache_dir)
+        self.mse = mse
+        self.render_kwargs = render_kwargs or {}
+        self._code = {
+            "aggregate": code_version,
+            "render": _hash(code_version, _code_version(fig_construction)),
+            "metrics": _hash(code_version, _code_version(metrics)),
+        }
+        self._fingerprints: Dict[Tuple[str, int], str] = {}
+        self._series_keys: Dict[tuple, str] = {}
+
+    def _path(self, stage: str, key: str, suffix: str) -> str:
+        return str(self.cache_dir / stage / key[:2] / f"{key}{suffix}")
+
+    def _fingerprint(self, data: str, n: int) -> str:
+        if (data, n) not in self._fingerprints:
+            s = self.grid.datasets[data].iloc[:n]
+            self._fingerprints[(data, n)] = _fingerprint(s)
+        return self._fingerprints[(data, n)]
+
+    # NOTE: the keys are independent of the cache location, i.e., they chain the
+    # upstream keys rather than the upstream paths
+    def _series_key(self, data: str, n: int, aggregator: str, n_out=None) -> str:
+        k = (data, n, aggregator, n_out)
+        if k not in self._series_keys:
+            code = self._code["aggregate"]
+            if aggregator != "reference":
+                agg_cls = {a.__name__: a for a in self.grid.aggregators}[aggregator]
+                code = _hash(code, _code_version(agg_cls))
+            fp = self._fingerprint(data, n)
+            self._series_keys[k] = _hash("aggregate", fp, aggregator, n_out, code)
+        return self._series_keys[k]
+
+    def _figure_key(self, spec: FigureSpec) -> str:
+        return _hash(
+            "render",
+            spec.toolkit,
+            spec.line_width,
+            spec.line_shape,
+            spec.aa,
+            self._series_key(spec.data, spec.n, spec.aggregator, spec.n_out),
+            self._series_key(spec.data, spec.n, "reference"),
+            self.render_kwargs,
+            self._code["render"],
+        )
+
+    def series_path(self, data: str, n: int, aggregator: str, n_out=None) -> str:
+        """Return the path of the (reference) series in the cache."""
+        key = self._series_key(data, n, aggregator, n_out)
+        return self._path("aggregate", key, ".parquet")
+
+    def figure_path(self, spec: FigureSpec) -> str:
+        """Return the path of the (reference) figure in the cache."""
+        return self._path("render", self._figure_key(spec), ".png")
+
+    def metrics_path(self, spec: FigureSpec) -> str:
+        """Return the path of the metrics row of the aggregated figure in the cache."""
+        figs = [
+            self._figure_key(s) for s in (spec, spec.reference(1), spec.reference())
+        ]
+        key = _hash("metrics", *figs, self.mse, self._code["metrics"])
+        return self._path("metrics", key, ".pkl")
+
+    # The grid iterators
+    def _iter_series(self) -> Iterable[Tuple[str, int, str, Optional[int]]]:
+        for data in self.grid.datasets:
+            for n in self.grid.n:
+                yield data, n, "reference", None
+                for agg in self.grid.aggregators:
+                    for n_out in self.grid.n_out:
+                        yield data, n, agg.__name__, int(n_out)
+
+    def _iter_figures(self, reference: bool) -> Iterable[FigureSpec]:
+        line_widths = self.grid.line_widths
+        if reference:  # the metrics also compare with the line width 1 reference
+            line_widths = sorted({1, *line_widths})
+        for toolkit in self.grid.toolkits:
+            for line_shape in self.grid.get_line_shapes(toolkit):
+                for lw in line_widths:
+                    for aa in self.grid.aa:
+                        for data, n, agg, n_out in self._iter_series():
+                            if (agg == "reference") == reference:
+                                yield FigureSpec(
+                                    data, n, n_out, agg, lw, line_shape, aa, toolkit
+                                )
+
+    def get_tasks(self, stage: str) -> List[Task]:
+        """Return the tasks of the `stage` whose artifacts are not (yet) cached."""
+        tasks = []
+        if stage == "aggregate":
+            for data in self.grid.datasets:
+                for n in self.grid.n:
+                    path = self.series_path(data, n, "reference")
+                    if not os.path.exists(path):
+                        params = dict(data=data, n=n, aggregator=None)
+                        tasks.append(Task(stage, params, {}, {"reference": path}))
+                    for agg in self.grid.aggregators:
+                        # NOTE: all `n_out` values of a series are aggregated at once
+                        outputs = {}
+                        for n_out in self.grid.n_out:
+                            path = self.series_path(data, n, agg.__name__, int(n_out))
+                            if not os.path.exists(path):
+                                outputs[str(int(n_out))] = path
+                        if outputs:
+                            params = dict(data=data, n=n, aggregator=agg)
+                            tasks.append(Task(stage, params, {}, outputs))
+        elif stage == "render":
+            specs = [*self._iter_figures(True), *self._iter_figures(False)]
+            for spec in specs:
+                path = self.figure_path(spec)
+                if os.path.exists(path):
+                    continue
+                inputs = dict(
+                    series=self.series_path(
+                        spec.data, spec.n, spec.aggregator, spec.n_out
+                    ),
+                    reference=self.series_path(spec.data, spec.n, "reference"),
+                )
+                params = dict(spec=spec, render_kwargs=self.render_kwargs)
+                tasks.append(Task(stage, params, inputs, {"png": path}))
+        elif stage == "metrics":
+            for spec in self._iter_figures(False):
+                path = self.metrics_path(spec)
+                if os.path.exists(path):
+                    continue
+                inputs = dict(
+                    png=self.figure_path(spec),
+                    ref_lw1=self.figure_path(spec.reference(1)),
+                    ref_same_lw=self.figure_path(spec.reference()),
+                )
+                params = dict(spec=spec, mse=self.mse)
+                tasks.append(Task(stage, params, inputs, {"row": path}))
+        else:
+            raise ValueError(f"Unknown stage: {stage}; must be one of {STAGES}")
+        return tasks
+
+    def run(
+        self,
+        stages: Sequence[str] = STAGES,
+        processes: Optional[int] = 8,
+        chunksize: int = 16,
+    ) -> pd.DataFrame:
+        """Run the (non-cached tasks of the) `stages` on a process pool.
+
+        Parameters
+        ----------
+        stages : Sequence[str], optional
+            The stages to run, by default all :data:`STAGES` (in order).
+        processes : int, optional
+            The number of worker processes, by default 8. If 0 or None, the tasks are
+            run in the current process.
+        chunksize : int, optional
+            The number of tasks per batch that is sent to a worker, by default 16.
+
+        Returns
+        -------
+        pd.DataFrame
+            The failed tasks, with their stage, params, and traceback. The artifacts
+            of the failed tasks are missing; a stage its tasks which depend on them
+            fail as well, and are retried on the next run.
+
+        """
+        failed = []
+        for stage_name in stages:
+            tasks = self.get_tasks(stage_name)
+            if not tasks:
+                continue
+            batches = [tasks[i : i + chunksize] for i in range(len(tasks))[::chunksize]]
+            # The datasets are only needed to aggregate
+            datasets = self.grid.datasets if stage_name == "aggregate" else {}
+            if not processes:
+                _init_worker(datasets)
+                results = map(_run_batch, batches)
+                results = tqdm(results, total=len(batches), desc=stage_name)
+                failed += [(t, e) for res in results for t, e in res if e is not None]
+                continue
+            with Pool(
+                processes, initializer=_init_worker, initargs=(datasets,)
+            ) as pool:
+                results = pool.imap_unordered(_run_batch, batches)
+                results = tqdm(results, total=len(batches), desc=stage_name)
+                failed += [(t, e) for res in results for t, e in res if e is not None]
+        return pd.DataFrame(
+            [(t.stage, t.params, e) for t, e in failed],
+            columns=["stage", "params", "error"],
+        )
+
+    def manifest(self, stage: str = "aggregate") -> pd.DataFrame:
+        """Return the artifacts of the `stage` with their metadata and cache path.
+
+        For the aggregate stage, the columns equal those of the former
+        ``agg_data.csv`` (i.e., data, aggregator, n, n_out, and path), extended with
+        a `done` column that indicates whether the artifact is cached.
+        """
+        if stage == "aggregate":
+            rows = [
+                dict(data=d, aggregator=a, n=n, n_out=n_out, path=p)
+                for d, n, a, n_out in self._iter_series()
+                for p in [self.series_path(d, n, a, n_out)]
+            ]
+        elif stage in ("render", "metrics"):
+            get_path = self.figure_path if stage == "render" else self.metrics_path
+            specs = self._iter_figures(False)
+            if stage == "render":
+                specs = [*self._iter_figures(True), *specs]
+            rows = [{**spec._asdict(), "path": get_path(spec)} for spec in specs]
+        else:
+            raise ValueError(f"Unknown stage: {stage}; must be one of {STAGES}")
+        df = pd.DataFrame(rows)
+        df["done"] = [os.path.exists(p) for p in df["path"]]
+        return df
+
+    def collect_metrics(self) -> pd.DataFrame:
+        """Return the (cached) metrics rows of all aggregated figures in the grid."""
+        paths = self.manifest("metrics").query("done").path
+        return pd.DataFrame([pd.read_pickle(p) for p in paths])
@@ -0,0 +1,441 @@
+"""Asyncio HTTP/JSON aggregation service for pan & zoom dashboards.
+
+A dashboard requests the aggregation of an (arbitrary) x-range window of a series on
+each pan or zoom (cf. the pan & zoom patterns of ``1.2_Visual_stability.ipynb``).
+The service
+
+- keeps the loaded series in memory (loaded once via :func:`get_series`),
+- runs the (CPU-bound) aggregation in a thread or process pool executor, so that the
+  event loop keeps serving other requests,
+- coalesces identical in-flight requests into a single aggregation, and
+- caches the results in an LRU, keyed by the quantized window and `n_out`; i.e., the
+  window is (outwardly) snapped to a power-of-two grid with `quantization` steps per
+  window width, so that small pans reuse the same result.
+
+Endpoints::
+
+    GET /aggregate?data=btc&n=50000&aggregator=M4Aggregator&n_out=1000[&x0=..&x1=..]
+    GET /stats
+    GET /health
+
+The ``/aggregate`` response is ``{"x": [...], "y": [...], "n_window": ...}``, where
+NaNs are ``null`` and datetimes are strings; the ``X-Cache`` header is ``hit``,
+``miss``, or ``coalesced``. For a datetime index, `x0` and `x1` are timestamps (e.g.,
+``2020-01-01T00:00:00``); otherwise, they are numbers.
+
+Example
+-------
+>>> python -m agg_utils.server --port 8080 --executor process --workers 4
+
+or, in a running event loop (e.g., with in-memory series)
+
+>>> server = AggregationServer()
+>>> server.add_series("btc", 50_000, btc_series)
+>>> port = await server.start(port=0)
+>>> async with AggregationClient("127.0.0.1", port) as client:
+...     status, headers, body = await client.get("/aggregate", data="btc", n=50000,
+...                                               aggregator="LTTB", n_out=1000)
+>>> await server.close()
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from .aggregators import (
+    LTTB,
+    M4Aggregator,
+    MinMaxLTTB,
+    RangeMinMaxAggregator,
+    _get_index_arr,
+    _get_xlim_arr,
+    _searchsorted_float,
+)
+from .data_hepers import get_series
+
+__all__ = ["AGGREGATORS", "AggregationServer", "AggregationClient"]
+
+AGGREGATORS = {
+    a.__name__: a for a in [M4Aggregator, RangeMinMaxAggregator, LTTB, MinMaxLTTB]
+}
+# The minimal n_out per aggregator; the LTTB variants return all data points when
+# there is no bucket in between the first and last point (i.e., n_out < 3)
+_MIN_N_OUT = {"LTTB": 3, "MinMaxLTTB": 3}
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Server Error"}
+
+
+class _HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _quantize_window(x0: float, x1: float, quantization: int) -> Tuple[float, float]:
+    """Snap the [x0, x1] window outward to a grid of `quantization` steps per width.
+
+    The grid step is a power of two, so that the snapped window bounds are exact
+    (float64) multiples of the step, and that zoom levels map onto discrete steps.
+    """
+    if not x1 > x0:
+        return x0, x1
+    step = 2.0 ** math.floor(math.log2((x1 - x0) / quantization))
+    return math.floor(x0 / step) * step, math.ceil(x1 / step) * step
+
+
+def _aggregate_window(s: pd.Series, aggregator: str, n_out: int) -> bytes:
+    """Aggregate the window `s` and return its JSON payload (an executor task)."""
+    agg = AGGREGATORS[aggregator](interleave_gaps=False)
+    s_agg = agg._aggregate(s, n_out) if len(s) > n_out else s
+    if s_agg.index.dtype.type in (np.datetime64, pd.Timestamp):
+        x = s_agg.index.astype(str).tolist()
+    else:
+        x = s_agg.index.tolist()
+    y = s_agg.to_numpy(dtype=np.float64)
+    payload = {
+        "x": x,
+        "y": np.where(np.isnan(y), None, y).tolist(),
+        "n_window": len(s),
+    }
+    return json.dumps(payload).encode()
+
+
+class AggregationServer:
+    """Asyncio HTTP/JSON aggregation service, see the module docstring."""
+
+    def __init__(
+        self,
+        loader: Optional[Callable[[str, int], pd.Series]] = None,
+        executor: str = "thread",
+        workers: Optional[int] = None,
+        cache_size: int = 1024,
+        quantization: int = 64,
+    ):
+        """
+        Parameters
+        ----------
+        loader : Callable[[str, int], pd.Series], optional
+            The function which loads the (full) series of a (data, n) pair, by
+            default None. If None, the reference series is loaded via
+            :func:`get_series`.
+        executor : str, optional
+            Either ``"thread"`` or ``"process"``, by default ``"thread"``; i.e., the
+            pool which runs the aggregations. The process pool avoids the GIL (e.g.,
+            for `LTTB`), at the cost of pickling each window to its worker.
+        workers : int, optional
+            The number of executor workers, by default None (i.e., the executor its
+            default).
+        cache_size : int, optional
+            The number of cached aggregation results, by default 1024.
+        quantization : int, optional
+            The number of quantization steps per window width, by default 64. Larger
+            values yield more precise windows, but fewer cache hits.
+
+        """
+        assert executor in ("thread", "process"), "executor must be thread or process"
+        self.loader = loader or (lambda data, n: get_series("reference", data, n))
+        self.executor_kind = executor
+        self.workers = workers
+        self.cache_size = cache_size
+        self.quantization = quantization
+
+        self._series: Dict[Tuple[str, int], pd.Series] = {}
+        self._cache: OrderedDict = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._executor: Optional[Executor] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+        self.counts = {k: 0 for k in ["requests", "hit", "miss", "coalesced", "error"]}
+
+    # ------------------------------------ SERIES ----------------------------------
+    def add_series(self, data: str, n: int, s: pd.Series):
+        """Add an (in-memory) series, which is then served as (data, n)."""
+        self._series[(data, int(n))] = s
+
+    async def get_series(self, data: str, n: int) -> pd.Series:
+        """Return the (data, n) series, which is loaded (only once) on first use."""
+        key = (data, int(n))
+        if key not in self._series:
+            loop = asyncio.get_running_loop()
+            # NOTE: the loading is I/O-bound, so it runs in the default thread pool
+            fut = self._get_inflight(
+                ("series",) + key,
+                lambda: loop.run_in_executor(None, self.loader, data, int(n)),
+            )
+            self._series[key] = await asyncio.shield(fut)
+        return self._series[key]
+
+    # ---------------------------------- AGGREGATION -------------------------------
+    def _get_inflight(
+        self, key: Hashable, func: Callable[[], Awaitable]
+    ) -> asyncio.Future:
+        """Return the in-flight future of `key`, or start it as ``func()``."""
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = self._inflight[key] = asyncio.ensure_future(func())
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return fut
+
+    def _store(self, key: Hashable, fut: asyncio.Future):
+        """Cache the (successful) result of `fut`, and evict the LRU results."""
+        if fut.cancelled() or fut.exception() is not None:
+            return
+        self._cache[key] = fut.result()
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def aggregate(
+        self,
+        data: str,
+        n: int,
+        aggregator: str,
+        n_out: int,
+        x0=None,
+        x1=None,
+    ) -> Tuple[bytes, str]:
+        """Return the JSON payload of the aggregated window, and its cache status.
+
+        The cache status is either ``"hit"``, ``"miss"``, or ``"coalesced"`` (i.e.,
+        the result of an identical in-flight request).
+        """
+        if aggregator not in AGGREGATORS:
+            raise _HTTPError(400, f"Unknown aggregator: {aggregator}")
+        # NOTE: validated here, as an invalid n_out would fail in the executor
+        n_per_bin = getattr(AGGREGATORS[aggregator], "_n_per_bin", 1)
+        if int(n_out) < 1 or int(n_out) % n_per_bin:
+            raise _HTTPError(
+                400, f"n_out must be a positive multiple of {n_per_bin}, got {n_out}"
+            )
+        min_n_out = _MIN_N_OUT.get(aggregator, 1)
+        if int(n_out) < min_n_out:
+            raise _HTTPError(
+                400, f"n_out must be at least {min_n_out} for {aggregator}, got {n_out}"
+            )
+        s = await self.get_series(data, n)
+
+        # The (quantized) window in the numeric space of the index
+        window = None
+        if x0 is not None or x1 is not None:
+            xlim = (s.index[0] if x0 is None else x0, s.index[-1] if x1 is None else x1)
+            window = _quantize_window(*_get_xlim_arr(s, xlim), self.quantization)
+
+        key = (data, int(n), aggregator, int(n_out), window)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key], "hit"
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key]), "coalesced"
+
+        if window is not None:
+            # NOTE: the window includes its right bound
+            bounds = np.array([window[0], np.nextafter(window[1], np.inf)])
+            lo, hi = _searchsorted_float(_get_index_arr(s), bounds)
+            s = s.iloc[lo:hi]
+        loop = asyncio.get_running_loop()
+        fut = self._get_inflight(
+            key,
+            lambda: loop.run_in_executor(
+                self._executor, _aggregate_window, s, aggregator, int(n_out)
+            ),
+        )
+        fut.add_done_callback(lambda fut: self._store(key, fut))
+        return await asyncio.shield(fut), "miss"
+
+    def stats(self) -> dict:
+        """Return the request counts and the cache state."""
+        return {
+            **self.counts,
+            "cache_entries": len(self._cache),
+            "cache_bytes": sum(len(v) for v in self._cache.values()),
+            "series": [f"{data}_{n}" for data, n in self._series],
+            "inflight": len(self._inflight),
+        }
+
+    # ------------------------------------- HTTP -----------------------------------
+    async def _route(self, method: str, target: str) -> Tuple[int, bytes, str]:
+        """Return the status, the JSON body, and the cache status of a request."""
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        if method != "GET":
+            raise _HTTPError(400, f"Unsupported method: {method}")
+        if url.path == "/health":
+            return 200, b'{"status": "ok"}', ""
+        if url.path == "/stats":
+            return 200, json.dumps(self.stats()).encode(), ""
+        if url.path != "/aggregate":
+            raise _HTTPError(404, f"Unknown path: {url.path}")
+
+        try:
+            body, cache = await self.aggregate(
+                params["data"],
+                int(params["n"]),
+                params.get("aggregator", "M4Aggregator"),
+                int(params["n_out"]),
+                params.get("x0"),
+                params.get("x1"),
+            )
+        except KeyError as e:
+            raise _HTTPError(400, f"Missing parameter: {e}")
+        except FileNotFoundError:
+            # NOTE: the (data, n) key, as the error message holds the local path
+            key = (params["data"], int(params["n"]))
+            raise _HTTPError(404, f"Unknown series: {key}")
+        except (ValueError, AssertionError, TypeError) as e:
+            raise _HTTPError(400, str(e) or type(e).__name__)
+        return 200, body, cache
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve the (keep-alive) HTTP/1.1 requests of a connection."""
+        task = asyncio.current_task()
+        self._connections[task] = writer  # type: ignore[index]
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get("content-length", 0)):  # i.e., ignore the body
+                    await reader.readexactly(int(headers["content-length"]))
+
+                self.counts["requests"] += 1
+                cache = ""
+                try:
+                    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                    status, body, cache = await self._route(method, target)
+                except _HTTPError as e:
+                    status, body = e.status, json.dumps({"error": str(e)}).encode()
+                except Exception as e:  # i.e., an unexpected server error
+                    status, body = 500, json.dumps({"error": repr(e)}).encode()
+                if status != 200:
+                    self.counts["error"] += 1
+                elif cache:
+                    self.counts[cache] += 1
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                head = [
+                    f"HTTP/1.1 {status} {_REASONS.get(status, '')}",
+                    "Content-Type: application/json",
+                    f"Content-Length: {len(body)}",
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}",
+                ]
+                if cache:
+                    head.append(f"X-Cache: {cache}")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(task, None)  # type: ignore[arg-type]
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> int:
+        """Start the executor and the HTTP server; return the (bound) port."""
+        if self.executor_kind == "process":
+            self._executor = ProcessPoolExecutor(self.workers)
+        else:
+            self._executor = ThreadPoolExecutor(self.workers)
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """Stop the HTTP server and shut down the executor."""
+        if self._server is not None:
+            self._server.close()
+            # NOTE: closing the (idle) keep-alive connections ends their handlers
+            for writer in list(self._connections.values()):
+                writer.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 8080):
+        port = await self.start(host, port)
+        print(f"Serving on http://{host}:{port}", flush=True)
+        try:
+            await self._server.serve_forever()  # type: ignore[union-attr]
+        finally:
+            await self.close()
+
+
+class AggregationClient:
+    """Minimal asyncio HTTP/1.1 client with a single keep-alive connection."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8080):
+        self.host, self.port = host, port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def __aenter__(self) -> AggregationClient:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        return self
+
+    async def __aexit__(self, *args):
+        if self._writer is not None:
+            self._writer.close()
+
+    async def get(self, path: str, **params) -> Tuple[int, Dict[str, str], bytes]:
+        """Send a GET request; return its status, (lowercase) headers, and body."""
+        assert self._reader is not None and self._writer is not None
+        target = path + ("?" + urlencode(params) if params else "")
+        self._writer.write(
+            f"GET {target} HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode()
+        )
+        await self._writer.drain()
+        status = int((await self._reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await self._reader.readexactly(int(headers["content-length"]))
+        return status, headers, body
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache-size", type=int, default=1024)
+    parser.add_argument("--quantization", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    server = AggregationServer(
+        executor=args.executor,
+        workers=args.workers,
+        cache_size=args.cache_size,
+        quantization=args.quantization,
+    )
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
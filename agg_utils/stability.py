@@ -0,0 +1,298 @@
+"""Vectorized visual stability metrics, i.e., the data-space agreement under pan & zoom.
+
+For a pan or zoom action, the series is aggregated before (`s1`) and after (`s2`) the
+action, after which the residuals of both aggregations are computed on their overlap
+(see ``1.2_Visual_stability.ipynb`` and ``details/vis_stability.md``).
+
+Rather than aggregating both windows of each (action, offset) from scratch, the
+:func:`compute_stability` function batches all offsets and actions of a
+(series, n, aggregator) tuple. As such, the `s1` aggregations are shared across the
+offsets and actions, the aggregators which support it aggregate all `n_out` values in
+a single pass, and the residuals are computed on numpy arrays. The
+:func:`compute_stability_grid` function runs the full grid on a process pool.
+"""
+
+from __future__ import annotations
+
+from multiprocessing import Pool
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Type
+
+import numpy as np
+import pandas as pd
+from plotly_resampler.aggregation import AbstractSeriesAggregator
+from scipy.signal import find_peaks
+
+from .aggregators import _get_index_arr
+from .instrumentation import instrumented, worker_task
+
+
+class Action(NamedTuple):
+    """A pan or zoom action, i.e., the sign of the (left, right) offset."""
+
+    name: str
+    sign_l: int
+    sign_r: int
+
+
+ACTIONS: Tuple[Action, ...] = (
+    Action("panning right", 1, 1),
+    Action("panning left", -1, -1),
+    Action("zoom-out right", 0, 1),
+    Action("zoom-out left", -1, 0),
+    Action("zoom-out left-and-right", -1, 1),
+    Action("zoom-in right", 1, 0),
+    Action("zoom-in left", 0, -1),
+    Action("zoom-in left-and-right", 1, -1),
+)
+
+
+def _get_windows(n: int, offset_l: float, offset_r: float) -> Tuple[int, ...]:
+    """Return the s1 [start, end), s2 [start, end), and overlap [l, r] positions."""
+    offset_l = int(offset_l * n)
+    offset_r = int(offset_r * n)
+    if offset_l < 0:
+        # If offset_l is negative, we right shift s1 with -offset_l
+        start = -offset_l
+        end = n + -offset_l
+    else:
+        # If the offset is positive, we can start s1 at 0
+        start = 0
+        end = n
+    # Calculate where the series overlap
+    overlap_l = max(start, start + offset_l)
+    overlap_r = min(end, end + offset_r)
+    return start, end, start + offset_l, end + offset_r, overlap_l, overlap_r
+
+
+@instrumented("stability.residuals")
+def _residual_metrics(
+    s1_agg: Tuple[np.ndarray, np.ndarray],
+    s2_agg: Tuple[np.ndarray, np.ndarray],
+    x_l,
+    x_r,
+    n_out: int,
+) -> Dict[str, float]:
+    """Compute the residual metrics of the (index, values) aggregations on [x_l, x_r].
+
+    This is the array-based equivalent of reducing both aggregated series to their
+    overlap via ``.loc[x_l:x_r]`` and interpolating s2 onto the index of s1.
+    """
+    (x1, v1), (x2, v2) = s1_agg, s2_agg
+    # NOTE: the aggregated indices are sorted, so the `.loc` slice is a binary search
+    sl1 = slice(np.searchsorted(x1, x_l, "left"), np.searchsorted(x1, x_r, "right"))
+    sl2 = slice(np.searchsorted(x2, x_l, "left"), np.searchsorted(x2, x_r, "right"))
+    x1, v1, x2, v2 = x1[sl1], v1[sl1], x2[sl2], v2[sl2]
+
+    # Interpolate the index of s2 to the index of s1
+    v2_interp = np.interp(x1.astype(np.float64), x2.astype(np.float64), v2)
+    # Calculate the range to scale with
+    scale_range = np.nanmax(v1) - np.nanmin(v1)
+    residuals = (v1 - v2_interp) / scale_range
+
+    # Find the (positive and negative) peaks of s1
+    pos_peaks, _ = find_peaks(v1, prominence=None)
+    neg_peaks, _ = find_peaks(-v1, prominence=None)
+    peaks = np.sort(np.concatenate([pos_peaks, neg_peaks]))
+    return {
+        "MAE": np.abs(residuals).mean(),
+        "MAE_peaks": np.abs(residuals[peaks]).mean(),
+        "pct_peaks": len(peaks) / n_out,
+    }
+
+
+def _to_arrays(s: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    return _get_index_arr(s), np.asarray(s.values)
+
+
+@instrumented("aggregate")
+def _aggregate_window(
+    series: pd.Series,
+    aggregator: Type[AbstractSeriesAggregator],
+    start: int,
+    end: int,
+    n_out_grid: Sequence[int],
+) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """Aggregate the [start, end) window of `series` for each `n_out`."""
+    s = series.iloc[start:end]
+    agg = aggregator()
+    if hasattr(agg, "_aggregate_n_out_grid"):
+        # e.g., the M4Aggregator, which shares the work over all `n_out` values
+        agg_dict = agg._aggregate_n_out_grid(s, n_out_grid)
+        return {n_out: _to_arrays(agg_dict[n_out]) for n_out in n_out_grid}
+    return {n_out: _to_arrays(agg._aggregate(s, n_out)) for n_out in n_out_grid}
+
+
+def compute_residuals(
+    series: pd.Series,
+    n: int,
+    n_out: int,
+    aggregator: Type[AbstractSeriesAggregator],
+    offset_l: float,
+    offset_r: float,
+) -> dict:
+    """Compute the MAE, and MAE at the peaks of the residuals of the two aggregated
+    series.
+
+    Parameters
+    ----------
+    series : pd.Series
+        The original series
+    n : int
+        The length of the series to aggregate
+    n_out : int
+        The number of points to select
+    aggregator : Type[AbstractSeriesAggregator]
+        The aggregator to use
+    offset_l : float
+        The offset of the left side of the series for the new aggregation
+    offset_r : float
+        The offset of the right side of the series for the new aggregation
+
+    Returns
+    -------
+    dict
+        A dictionary containing the MAE, MAE at the peaks of the residuals, and the
+        fraction of peaks
+
+    """
+    start, end, start2, end2, overlap_l, overlap_r = _get_windows(n, offset_l, offset_r)
+    assert end2 - start2 == n - int(offset_l * n) + int(offset_r * n)
+    s1_agg = _aggregate_window(series, aggregator, start, end, [n_out])[n_out]
+    s2_agg = _aggregate_window(series, aggregator, start2, end2, [n_out])[n_out]
+    x = _get_index_arr(series)
+    return _residual_metrics(s1_agg, s2_agg, x[overlap_l], x[overlap_r], n_out)
+
+
+def compute_stability(
+    series: pd.Series,
+    n: int,
+    n_out_grid: Sequence[int],
+    aggregator: Type[AbstractSeriesAggregator],
+    offsets: Iterable[float],
+    actions: Sequence[Action] = ACTIONS,
+) -> List[dict]:
+    """Compute the residual metrics of all (n_out, offset, action) combinations.
+
+    The output is identical to calling :func:`compute_residuals` for each
+    combination, with ``offset_l = action.sign_l * offset`` and
+    ``offset_r = action.sign_r * offset``. However, each window is aggregated only
+    once (for all `n_out` values); e.g., the s1 window is shared by all actions
+    which do not shift the left side of the series to the left. As the aggregated
+    windows are small (i.e., O(n_out)), all of them are kept until the end.
+
+    Returns
+    -------
+    List[dict]
+        A list with a row per combination, holding the n_out, offset_l, offset_r,
+        and the :func:`compute_residuals` metrics.
+
+    """
+    n_out_grid = list(n_out_grid)
+    x = _get_index_arr(series)
+    window_cache: Dict[Tuple[int, int], Dict[int, Tuple[np.ndarray, np.ndarray]]] = {}
+
+    def _get_agg(start: int, end: int) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        if (start, end) not in window_cache:
+            window_cache[(start, end)] = _aggregate_window(
+                series, aggregator, start, end, n_out_grid
+            )
+        return window_cache[(start, end)]
+
+    rows = []
+    for offset in offsets:
+        for action in actions:
+            # NOTE: the unshifted sides have an (int) offset of 0, as in the notebook
+            offset_l = action.sign_l * offset if action.sign_l else 0
+            offset_r = action.sign_r * offset if action.sign_r else 0
+            start, end, start2, end2, overlap_l, overlap_r = _get_windows(
+                n, offset_l, offset_r
+            )
+            assert end - start == n
+            # NOTE: the s2 window of e.g. a left pan equals the shared s1 window
+            s1_aggs, s2_aggs = _get_agg(start, end), _get_agg(start2, end2)
+            for n_out in n_out_grid:
+                metrics = _residual_metrics(
+                    s1_aggs[n_out], s2_aggs[n_out], x[overlap_l], x[overlap_r], n_out
+                )
+                rows.append(
+                    {
+                        "n_out": n_out,
+                        "offset_l": offset_l,
+                        "offset_r": offset_r,
+                        **metrics,
+                    }
+                )
+    return rows
+
+
+# The series of the worker processes of `compute_stability_grid`
+_WORKER_SERIES: Dict[str, pd.Series] = {}
+
+
+def _init_worker(series_dict: Dict[str, pd.Series]):
+    global _WORKER_SERIES
+    _WORKER_SERIES = series_dict
+
+
+@worker_task
+def _compute_stability_task(task: tuple) -> List[dict]:
+    series_name, n, n_out_grid, aggregator, offsets, actions = task
+    rows = compute_stability(
+        _WORKER_SERIES[series_name], n, n_out_grid, aggregator, offsets, actions
+    )
+    meta = {"aggregator": aggregator.__name__, "data": series_name, "n": n}
+    return [{**meta, **row} for row in rows]
+
+
+def compute_stability_grid(
+    series_dict: Dict[str, pd.Series],
+    n_grid: Iterable[int],
+    n_out_grid: Sequence[int],
+    aggregators: Iterable[Type[AbstractSeriesAggregator]],
+    offsets: Sequence[float],
+    actions: Sequence[Action] = ACTIONS,
+    processes: Optional[int] = 8,
+) -> pd.DataFrame:
+    """Compute the visual stability metrics of the full grid on a process pool.
+
+    Parameters
+    ----------
+    series_dict : Dict[str, pd.Series]
+        The series, keyed by their (data) name.
+    n_grid : Iterable[int]
+        The lengths of the series to aggregate.
+    n_out_grid : Sequence[int]
+        The number of points to select.
+    aggregators : Iterable[Type[AbstractSeriesAggregator]]
+        The aggregator classes.
+    offsets : Sequence[float]
+        The (relative) offsets of the pan and zoom actions.
+    actions : Sequence[Action], optional
+        The pan and zoom actions, by default all :data:`ACTIONS`.
+    processes : int, optional
+        The number of worker processes, by default 8. If 0 or None, the grid is
+        computed in the current process.
+
+    Returns
+    -------
+    pd.DataFrame
+        A row per (aggregator, data, n, n_out, offset_l, offset_r) combination, with
+        the MAE, MAE_peaks, and pct_peaks columns; i.e., the `df_metrics` of the
+        visual stability notebook.
+
+    """
+    # NOTE: the largest tasks are scheduled first, to balance the worker load
+    tasks = [
+        (name, n, list(n_out_grid), aggregator, list(offsets), list(actions))
+        for n in sorted(n_grid, reverse=True)
+        for name in series_dict
+        for aggregator in aggregators
+    ]
+    if not processes:
+        _init_worker(series_dict)
+        rows = [row for task in tasks for row in _compute_stability_task(task)]
+    else:
+        with Pool(processes, initializer=_init_worker, initargs=(series_dict,)) as pool:
+            results = pool.imap_unordered(_compute_stability_task, tasks)
+            rows = [row for task_rows in results for row in task_rows]
+    return pd.DataFrame(rows)
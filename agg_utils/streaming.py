@@ -0,0 +1,245 @@
+"""Out-of-core (chunked) M4 and MinMax aggregation.
+
+The aggregators in this module consume a series chunk by chunk (e.g., Parquet row
+groups or slices of a ``np.memmap``) while keeping a running first / min / max / last
+state per bin. As such, the peak memory is bounded by the chunk size plus O(n_out).
+
+The output is identical to the in-memory :class:`M4Aggregator` and
+:class:`RangeMinMaxAggregator` their output.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from .aggregators import _argmin_argmax_per_bin
+from .instrumentation import instrumented
+
+
+def _to_int_view(x: np.ndarray) -> np.ndarray:
+    """View datetime arrays as int64, just like the in-memory aggregators do."""
+    return x.view("int64") if x.dtype.kind == "M" else x
+
+
+class StreamingM4Aggregator:
+    """Chunked M4 (or MinMax) aggregation with a running per-bin state.
+
+    The chunks must be passed in index order and the index must be sorted.
+
+    .. note::
+        As the M4 bins are determined by the index range, the first and last index
+        value of the full series must be known up front. Use e.g.
+        :func:`get_parquet_x_range` to retrieve these without loading all data.
+
+    """
+
+    def __init__(self, n_out: int, x_first, x_last, minmax: bool = False):
+        """
+        Parameters
+        ----------
+        n_out : int
+            The number of output points, must be a multiple of 4 (or of 2 when
+            ``minmax`` is True).
+        x_first : scalar
+            The first index value of the full series.
+        x_last : scalar
+            The last index value of the full series.
+        minmax : bool, optional
+            Whether to only select the min & max per bin (i.e., the
+            :class:`RangeMinMaxAggregator` output), by default False.
+
+        """
+        n_per_bin = 2 if minmax else 4
+        assert n_out % n_per_bin == 0, f"n_out must be a multiple of {n_per_bin}"
+        self.minmax = minmax
+        self.n_bins = n_out // n_per_bin
+
+        x_range = _to_int_view(pd.Index([x_first, x_last]).to_numpy())
+        # Inner bin edges, see `aggregators._get_m4_bins`; the last edge is omitted
+        # as the in-memory aggregator replaces it with the series its length
+        self._edges = np.linspace(x_range[0], x_range[1], self.n_bins + 1)[:-1]
+
+        # The running state; position -1 indicates that no value is set
+        self._pos = np.full((4, self.n_bins), -1, dtype=np.int64)
+        self._x: Optional[np.ndarray] = None
+        self._y: Optional[np.ndarray] = None
+        self._ext = np.full((2, self.n_bins), np.nan)
+        self._n = 0  # the number of processed samples
+        self._x_last_seen = None
+
+    def _init_buffers(self, x: np.ndarray, y: np.ndarray):
+        self._x = np.zeros((4, self.n_bins), dtype=x.dtype)
+        self._y = np.zeros((4, self.n_bins), dtype=y.dtype)
+
+    def update(self, x: np.ndarray, y: np.ndarray) -> StreamingM4Aggregator:
+        """Update the running state with the next chunk.
+
+        Parameters
+        ----------
+        x : np.ndarray
+            The (sorted) index values of the chunk.
+        y : np.ndarray
+            The corresponding data values.
+
+        """
+        x, y = np.asarray(x), np.asarray(y)
+        assert len(x) == len(y), "x and y must have the same length"
+        if not len(x):
+            return self
+        if self._x is None:
+            self._init_buffers(x, y)
+        x_i = _to_int_view(x)
+        if self._x_last_seen is not None:
+            assert x_i[0] >= self._x_last_seen, "chunks must be passed in index order"
+        self._x_last_seen = x_i[-1]
+
+        # The bin of each sample; the bins are contiguous as the index is sorted
+        b = np.searchsorted(self._edges, x_i, side="right") - 1
+        seg_starts = np.flatnonzero(np.diff(b, prepend=-1))
+        seg_bins = b[seg_starts]
+        seg_edges = np.append(seg_starts, len(b))
+
+        # first & last position of each segment
+        first = self._pos[0, seg_bins] < 0
+        self._set(0, seg_bins[first], seg_starts[first], x, y)
+        self._set(3, seg_bins, seg_edges[1:] - 1, x, y)
+
+        # min & max of each segment, which are merged with the running state
+        # NOTE: only a strictly smaller / larger value replaces the state, so that
+        # the first occurrence is retained (just as ``pd.Series.idxmin``)
+        argmin, argmax = _argmin_argmax_per_bin(y, seg_edges)
+        for k, arg, better in ((0, argmin, np.less), (1, argmax, np.greater)):
+            valid = arg >= 0
+            bins_, arg = seg_bins[valid], arg[valid]
+            ext = self._ext[k, bins_]
+            upd = np.isnan(ext) | better(y[arg], ext)
+            self._ext[k, bins_[upd]] = y[arg[upd]]
+            self._set(k + 1, bins_[upd], arg[upd], x, y)
+
+        self._n += len(x)
+        return self
+
+    def _set(self, k: int, bins: np.ndarray, pos: np.ndarray, x, y):
+        self._pos[k, bins] = pos + self._n
+        self._x[k, bins] = x[pos]
+        self._y[k, bins] = y[pos]
+
+    def to_series(self, name=None, index_name=None) -> pd.Series:
+        """Return the aggregated series for all chunks that have been processed."""
+        if self._x is None:
+            return pd.Series(dtype=np.float64, name=name)
+        non_empty = self._pos[0] >= 0
+        if (self._pos[1:3, non_empty] < 0).any():
+            raise ValueError("Encountered a bin with all NA values")
+        rows = [1, 2] if self.minmax else [0, 1, 2, 3]
+
+        # NOTE: we do not use the np.unique so that all indices are retained
+        pos = self._pos[rows][:, non_empty].ravel()
+        order = np.argsort(pos, kind="stable")
+        return pd.Series(
+            self._y[rows][:, non_empty].ravel()[order],
+            index=pd.Index(self._x[rows][:, non_empty].ravel()[order], name=index_name),
+            name=name,
+        )
+
+
+def iter_memmap_chunks(
+    x: np.ndarray, y: np.ndarray, chunk_size: int = 5_000_000
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Yield in-memory ``(x, y)`` chunks of the (memory-mapped) arrays."""
+    for start in range(0, len(x), chunk_size):
+        yield (
+            np.asarray(x[start : start + chunk_size]),
+            np.asarray(y[start : start + chunk_size]),
+        )
+
+
+def iter_parquet_chunks(
+    path: str | Path, x_col: Optional[str] = None, y_col: Optional[str] = None
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Yield the ``(x, y)`` arrays of each row group of a Parquet file.
+
+    When no columns are passed, the first column is used as index and the second as
+    data column (see :func:`data_hepers.get_series`).
+    """
+    pf = pq.ParquetFile(path)
+    x_col, y_col = _get_parquet_cols(pf, x_col, y_col)
+    for i in range(pf.num_row_groups):
+        tbl = pf.read_row_group(i, columns=[x_col, y_col])
+        yield (
+            tbl.column(x_col).to_numpy(),
+            tbl.column(y_col).to_numpy(),
+        )
+
+
+def _get_parquet_cols(pf: pq.ParquetFile, x_col, y_col) -> Tuple[str, str]:
+    names = pf.schema_arrow.names
+    return x_col or names[0], y_col or names[1]
+
+
+def get_parquet_x_range(path: str | Path, x_col: Optional[str] = None) -> Tuple:
+    """Return the first and last index value, only reading the outer row groups."""
+    pf = pq.ParquetFile(path)
+    x_col, _ = _get_parquet_cols(pf, x_col, "")
+    first = pf.read_row_group(0, columns=[x_col]).column(x_col).to_numpy()
+    last = pf.read_row_group(pf.num_row_groups - 1, columns=[x_col])
+    return first[0], last.column(x_col).to_numpy()[-1]
+
+
+@instrumented("aggregate")
+def aggregate_chunks(
+    chunks: Iterable[Tuple[np.ndarray, np.ndarray]],
+    n_out: int,
+    x_range: Tuple,
+    minmax: bool = False,
+    **kwargs,
+) -> pd.Series:
+    """Aggregate the ``(x, y)`` chunks with the :class:`StreamingM4Aggregator`.
+
+    The ``kwargs`` are passed to :meth:`StreamingM4Aggregator.to_series`.
+    """
+    agg = StreamingM4Aggregator(n_out, *x_range, minmax=minmax)
+    for x, y in chunks:
+        agg.update(x, y)
+    return agg.to_series(**kwargs)
+
+
+def aggregate_parquet(
+    path: str | Path,
+    n_out: int,
+    minmax: bool = False,
+    x_col: Optional[str] = None,
+    y_col: Optional[str] = None,
+) -> pd.Series:
+    """Aggregate a Parquet file row group by row group."""
+    pf = pq.ParquetFile(path)
+    x_col, y_col = _get_parquet_cols(pf, x_col, y_col)
+    return aggregate_chunks(
+        iter_parquet_chunks(path, x_col, y_col),
+        n_out,
+        x_range=get_parquet_x_range(path, x_col),
+        minmax=minmax,
+        name=y_col,
+        index_name=x_col,
+    )
+
+
+def aggregate_memmap(
+    x: np.ndarray,
+    y: np.ndarray,
+    n_out: int,
+    minmax: bool = False,
+    chunk_size: int = 5_000_000,
+) -> pd.Series:
+    """Aggregate (memory-mapped) index and value arrays in chunks."""
+    return aggregate_chunks(
+        iter_memmap_chunks(x, y, chunk_size),
+        n_out,
+        x_range=(x[0], x[-1]),
+        minmax=minmax,
+    )
@@ -0,0 +1 @@
+"""Offline benchmark suites for the `agg_utils` hot paths; see the README."""
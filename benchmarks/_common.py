@@ -0,0 +1,271 @@
+"""Shared utilities of the benchmark suites.
+
+- synthetic stand-ins for the datasets (which are not needed to benchmark offline)
+- wall time, tracemalloc peak, and peak RSS measurements
+- machine-readable (JSON) results with the commit and environment metadata, and a
+  comparison of two results files
+"""
+
+from __future__ import annotations
+
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = Path(__file__).absolute().parent.parent
+RESULTS_DIR = REPO_DIR / "benchmarks" / "results"
+
+DATASETS = ("noise", "sine", "walk", "step")
+INDEX_KINDS = ("range", "float", "datetime", "datetime_gappy")
+
+
+def make_series(dataset: str, n: int, index: str = "range", seed: int = 0) -> pd.Series:
+    """Create a synthetic stand-in of a dataset with `n` samples.
+
+    Parameters
+    ----------
+    dataset : str
+        One of :data:`DATASETS`; i.e., high-frequency "noise" (cf. hf_noise), a
+        "sine" with 50 periods (cf. hf_sine), a random "walk" (cf. btc), or a "step"
+        signal of plateaus with repeated values (cf. the ball speed data).
+    n : int
+        The number of samples.
+    index : str, optional
+        One of :data:`INDEX_KINDS`, by default "range"; i.e., an int64 range index,
+        a (sorted, irregular) float64 index, a 1s datetime index, or a 1s datetime
+        index with gaps (cf. the ball speed and power datasets).
+    seed : int, optional
+        The random seed, by default 0.
+
+    """
+    rng = np.random.default_rng(seed)
+    if dataset == "noise":
+        values = rng.standard_normal(n)
+    elif dataset == "sine":
+        values = np.sin(np.linspace(0, 100 * np.pi, n)) + 0.05 * rng.standard_normal(n)
+    elif dataset == "walk":
+        values = np.cumsum(rng.standard_normal(n))
+    elif dataset == "step":
+        # Plateaus of 1 up to 1000 samples, at 1 of 20 levels
+        lengths = rng.integers(1, 1000, n // 500 + 1)
+        values = np.repeat(rng.integers(0, 20, len(lengths)) / 4, lengths)[:n]
+        values = np.resize(values, n)
+    else:
+        raise ValueError(f"Unknown dataset: {dataset}; must be one of {DATASETS}")
+
+    if index == "range":
+        idx = pd.RangeIndex(n)
+    elif index == "float":
+        idx = pd.Index(np.cumsum(rng.exponential(1.0, n)))
+    elif index in ("datetime", "datetime_gappy"):
+        steps = np.ones(n, dtype=np.int64)
+        if index == "datetime_gappy":
+            # ~0.1% of the steps are gaps of 1 minute up to 1 hour
+            gaps = rng.random(n) < 1e-3
+            steps[gaps] = rng.integers(60, 3600, gaps.sum())
+        idx = pd.DatetimeIndex(
+            np.datetime64("2020-01-01", "s") + np.cumsum(steps).astype("timedelta64[s]")
+        )
+    else:
+        raise ValueError(f"Unknown index: {index}; must be one of {INDEX_KINDS}")
+    return pd.Series(values, index=idx, name=dataset)
+
+
+def make_frame(
+    dataset: str, n: int, n_columns: int, index: str = "range", seed: int = 0
+) -> pd.DataFrame:
+    """Create a multi-channel stand-in, i.e., `n_columns` series on a shared index.
+
+    See :func:`make_series` for the arguments; column ``j`` uses seed ``seed + j``.
+    """
+    s = make_series(dataset, n, index, seed)
+    return pd.DataFrame(
+        {
+            f"{dataset}_{j}": (
+                s.values if j == 0 else make_series(dataset, n, seed=seed + j).values
+            )
+            for j in range(n_columns)
+        },
+        index=s.index,
+    )
+
+
+def latency_stats(times: List[float]) -> Dict[str, float]:
+    """Return the distribution of the per-call latencies (in seconds)."""
+    t = np.asarray(times)
+    return {
+        "n_calls": len(t),
+        "time_best_s": float(t.min()),
+        "time_median_s": float(np.median(t)),
+        "time_mean_s": float(t.mean()),
+        "time_std_s": float(t.std()),
+        "time_p90_s": float(np.percentile(t, 90)),
+        "time_p99_s": float(np.percentile(t, 99)),
+        "time_max_s": float(t.max()),
+    }
+
+
+def time_func(
+    func: Callable[[], object], repeat: int = 5, min_time: float = 0.2
+) -> Dict[str, float]:
+    """Time `func` and return the distribution of its wall time (in seconds).
+
+    The function is called at least `repeat` times, and at least `min_time` seconds
+    (for fast functions) in total; see :func:`latency_stats` for the statistics.
+    """
+    gc.collect()
+    times: List[float] = []
+    t_start = time.perf_counter()
+    while len(times) < repeat or time.perf_counter() - t_start < min_time:
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+        if len(times) >= 1000:
+            break
+    return latency_stats(times)
+
+
+def _read_vm_hwm() -> Optional[int]:
+    """Return the peak RSS (VmHWM) of this process in bytes (Linux only)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _get_rss_peak() -> Tuple[int, Callable[[], int]]:
+    """Reset the RSS peak (if possible), and return it and a function to read it."""
+    try:
+        # NOTE: writing "5" to clear_refs resets the VmHWM to the current RSS
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        rss = _read_vm_hwm()
+        if rss is not None:
+            return rss, _read_vm_hwm  # type: ignore[return-value]
+    except OSError:
+        pass
+    # e.g., macOS (where ru_maxrss is in bytes); the ru_maxrss is monotonic
+    scale = 1 if sys.platform == "darwin" else 1024
+
+    def _read_ru_maxrss() -> int:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    return _read_ru_maxrss(), _read_ru_maxrss
+
+
+def measure_memory(func: Callable[[], object]) -> Dict[str, int]:
+    """Measure the peak memory of a single `func` call.
+
+    Returns the tracemalloc peak (i.e., the Python & numpy allocations) and the RSS
+    peak increase. On Linux, the RSS peak (VmHWM) is reset before the call by writing
+    to ``/proc/self/clear_refs``; otherwise the (monotonic) ``ru_maxrss`` is used,
+    which only captures a new process-wide peak. Note that the RSS increase can be
+    0 when the allocator reuses memory which was freed by earlier calls.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # NOTE: the RSS is measured in a separate call, as tracemalloc allocates as well
+    gc.collect()
+    rss_before, read_rss_peak = _get_rss_peak()
+    func()
+    return {
+        "tracemalloc_peak_bytes": peak,
+        "rss_peak_delta_bytes": read_rss_peak() - rss_before,
+    }
+
+
+def get_metadata(suite: str, config: dict) -> dict:
+    """Return the commit and environment metadata of a benchmark run."""
+
+    def _git(*args) -> Optional[str]:
+        try:
+            out = subprocess.run(
+                ["git", *args],
+                cwd=REPO_DIR,
+                capture_output=True,
+                text=True,
+                timeout=10,
+                check=False,
+            )
+            return out.stdout.strip() if out.returncode == 0 else None
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    import plotly_resampler
+    import scipy
+
+    return {
+        "suite": suite,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "scipy": scipy.__version__,
+        "plotly_resampler": getattr(plotly_resampler, "__version__", None),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+    }
+
+
+def write_results(path: str | Path, metadata: dict, records: List[dict]):
+    """Write the results as JSON, i.e., ``{"metadata": ..., "results": [...]}``."""
+    path = Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"metadata": metadata, "results": records}, f, indent=1)
+
+
+def get_default_output(suite: str) -> Path:
+    """Return the default results path, i.e., ``results/<suite>_<commit>_<time>``."""
+    meta = get_metadata(suite, {})
+    commit = (meta["commit"] or "nogit")[:8] + ("-dirty" if meta["dirty"] else "")
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+    return RESULTS_DIR / f"{suite}_{commit}_{stamp}.json"
+
+
+def compare_results(
+    baseline: str | Path,
+    current: str | Path,
+    key_cols: List[str],
+    metric: str = "time_best_s",
+) -> pd.DataFrame:
+    """Compare two results files of the same suite on their best wall time.
+
+    Returns a DataFrame with, per case (identified by the `key_cols`), the baseline
+    and current time (i.e., the `metric`) and their ratio (i.e., > 1 is a
+    regression).
+    """
+    dfs = []
+    for path in (baseline, current):
+        with open(path) as f:
+            dfs.append(pd.DataFrame(json.load(f)["results"]))
+    df = dfs[0].merge(dfs[1], on=key_cols, suffixes=("_baseline", "_current"))
+    df["ratio"] = df[f"{metric}_current"] / df[f"{metric}_baseline"]
+    cols = key_cols + [f"{metric}_baseline", f"{metric}_current", "ratio"]
+    return df[cols].sort_values("ratio", ascending=False, ignore_index=True)
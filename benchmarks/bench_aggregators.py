@@ -0,0 +1,254 @@
+"""Throughput and memory benchmark of the aggregators.
+
+For each (dataset, n, index, aggregator, n_out) case, the wall time, the throughput
+(i.e., input points per second), and the peak memory of aggregating a synthetic
+series are measured. The ``M4Aggregator[grid]`` case aggregates all `n_out` values in
+a single ``_aggregate_n_out_grid`` pass (as done by the scheduler and the stability
+engine); its time is that of the full grid. The ``[frame]`` cases aggregate a
+DataFrame of `n_columns` channels (which share the index) via ``_aggregate_frame``,
+and the ``[columns]`` cases aggregate its columns one by one; their time is that of
+all columns. The ``PixelM4Aggregator``, which ignores the `n_out`, is run once per
+series and keyed by ``n_out = 4 * width`` (i.e., its 800 pixel wide canvas). The
+in-repo ``LTTB`` output is verified to be identical to the plotly-resampler (`lttbc`)
+``LTTB`` output; the benchmark exits with an error otherwise.
+
+Usage (from the repository root)::
+
+    python -m benchmarks.bench_aggregators --quick
+    python -m benchmarks.bench_aggregators --n 1000000 --aggregators M4Aggregator LTTB
+    python -m benchmarks.bench_aggregators --compare a.json b.json
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+import plotly_resampler.aggregation as pr_agg
+from plotly_resampler.aggregation import EveryNthPoint, MinMaxAggregator
+
+from agg_utils.aggregators import (
+    LTTB,
+    M4Aggregator,
+    MinMaxLTTB,
+    PixelM4Aggregator,
+    RangeMinMaxAggregator,
+)
+
+from ._common import (
+    DATASETS,
+    INDEX_KINDS,
+    compare_results,
+    get_default_output,
+    get_metadata,
+    make_frame,
+    make_series,
+    measure_memory,
+    time_func,
+    write_results,
+)
+
+SUITE = "aggregators"
+N_GRID = [50_000, 200_000, 1_000_000, 10_000_000]
+N_OUT_GRID = [200, 1000, 4000]
+AGGREGATORS = {
+    a.__name__: a
+    for a in [
+        M4Aggregator,
+        # NOTE: the `PixelM4Aggregator` ignores the n_out, its output size is set by
+        # its (default) canvas; i.e., the 800 pixel wide canvas of the quality
+        # benchmark. Hence, it is only run once per series (see `PIXEL_CASE`)
+        PixelM4Aggregator,
+        RangeMinMaxAggregator,
+        LTTB,
+        MinMaxLTTB,
+        MinMaxAggregator,
+        EveryNthPoint,
+    ]
+}
+# i.e., the plotly-resampler (lttbc) reference of the in-repo `LTTB`
+AGGREGATORS["plotly_resampler.LTTB"] = pr_agg.LTTB
+GRID_CASE = "M4Aggregator[grid]"
+PIXEL_CASE = "PixelM4Aggregator"
+FRAME_CASES = [
+    f"{a.__name__}[{kind}]"
+    for a in [M4Aggregator, RangeMinMaxAggregator]
+    for kind in ["frame", "columns"]
+]
+N_COLUMNS = 16
+# The frame cases are skipped for larger frames (i.e., > 256MB of float64 values)
+MAX_FRAME_SIZE = 2**25
+KEY_COLS = ["dataset", "n", "index", "aggregator", "n_out"]
+
+
+def _get_cases(
+    s: pd.Series,
+    aggregators: List[str],
+    n_out_grid: List[int],
+    df: Optional[pd.DataFrame] = None,
+) -> Dict[tuple, Callable[[], object]]:
+    """Return the (aggregator, n_out) benchmark cases of the series `s` (and `df`)."""
+    cases = {}
+    for name in aggregators:
+        if name in FRAME_CASES:
+            if df is None:
+                continue
+            agg_name, kind = name[:-1].split("[")
+            for n_out in n_out_grid:
+                agg = AGGREGATORS[agg_name]()
+                if kind == "frame":
+                    func = lambda agg=agg, n_out=n_out: agg._aggregate_frame(df, n_out)
+                else:
+                    func = lambda agg=agg, n_out=n_out: {
+                        c: agg._aggregate(df[c], n_out) for c in df
+                    }
+                cases[(name, n_out)] = func
+            continue
+        if name == GRID_CASE:
+            agg = M4Aggregator()
+            cases[(name, max(n_out_grid))] = lambda agg=agg: agg._aggregate_n_out_grid(
+                s, n_out_grid
+            )
+            continue
+        if name == PIXEL_CASE:
+            # i.e., keyed as the M4Aggregator with the same (column) bins
+            agg = PixelM4Aggregator()
+            cases[(name, 4 * agg.width)] = lambda agg=agg: agg._aggregate(s)
+            continue
+        for n_out in n_out_grid:
+            agg = AGGREGATORS[name]()
+            cases[(name, n_out)] = lambda agg=agg, n_out=n_out: agg._aggregate(s, n_out)
+    return cases
+
+
+def run(
+    datasets: List[str],
+    n_grid: List[int],
+    index_kinds: List[str],
+    aggregators: List[str],
+    n_out_grid: List[int],
+    repeat: int = 5,
+    memory: bool = True,
+    n_columns: int = N_COLUMNS,
+    verbose: bool = True,
+) -> List[dict]:
+    """Run the benchmark and return a record per case."""
+    frame_cases = any(name in FRAME_CASES for name in aggregators)
+    records = []
+    for n in n_grid:
+        # NOTE: at 10M points, a (slow) case takes seconds; limit its repeats
+        repeat_ = repeat if n < 5_000_000 else min(repeat, 2)
+        for dataset in datasets:
+            for index in index_kinds:
+                s = make_series(dataset, n, index)
+                df = None
+                if frame_cases and n * n_columns <= MAX_FRAME_SIZE:
+                    df = make_frame(dataset, n, n_columns, index)
+                cases = _get_cases(s, aggregators, n_out_grid, df)
+                for (name, n_out), func in cases.items():
+                    n_points = n * n_columns if name in FRAME_CASES else n
+                    rec = {
+                        "dataset": dataset,
+                        "n": n,
+                        "index": index,
+                        "index_dtype": str(s.index.dtype),
+                        "aggregator": name,
+                        "n_out": n_out,
+                        "n_columns": n_columns if name in FRAME_CASES else 1,
+                        **time_func(func, repeat=repeat_),
+                    }
+                    rec["points_per_s"] = n_points / rec["time_best_s"]
+                    if name == "LTTB":
+                        reference = pr_agg.LTTB()._aggregate(s, n_out)
+                        rec["identical"] = bool(func().index.equals(reference.index))
+                    if memory:
+                        rec.update(measure_memory(func))
+                    records.append(rec)
+                    if verbose:
+                        check = (
+                            f" identical={rec['identical']}"
+                            if "identical" in rec
+                            else ""
+                        )
+                        print(
+                            f"{dataset:>5} n={n:<9} {index:<14} {name:<22} "
+                            f"n_out={n_out:<5} {rec['time_best_s'] * 1e3:10.2f} ms "
+                            f"{rec['points_per_s'] / 1e6:9.1f} Mpts/s{check}",
+                            flush=True,
+                        )
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n", type=int, nargs="+", default=N_GRID)
+    parser.add_argument("--n-out", type=int, nargs="+", default=N_OUT_GRID)
+    parser.add_argument("--datasets", nargs="+", default=list(DATASETS))
+    parser.add_argument("--index", nargs="+", default=list(INDEX_KINDS))
+    parser.add_argument(
+        "--aggregators",
+        nargs="+",
+        default=list(AGGREGATORS) + [GRID_CASE] + FRAME_CASES,
+    )
+    parser.add_argument(
+        "--n-columns",
+        type=int,
+        default=N_COLUMNS,
+        help="the number of columns of the frame cases",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-memory", action="store_true", help="skip the memory")
+    parser.add_argument(
+        "--quick", action="store_true", help="a smoke run; n=50k, a single dataset"
+    )
+    parser.add_argument("--output", help="the results JSON, by default in results/")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="compare two results files, instead of running the benchmark",
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(compare_results(*args.compare, key_cols=KEY_COLS))
+        return
+
+    if args.quick:
+        args.n, args.datasets, args.repeat = [50_000], ["noise"], 3
+    unknown = set(args.aggregators) - set(AGGREGATORS) - {GRID_CASE, *FRAME_CASES}
+    if unknown:
+        parser.error(f"unknown aggregators: {sorted(unknown)}")
+
+    config = {
+        "datasets": args.datasets,
+        "n": args.n,
+        "index": args.index,
+        "aggregators": args.aggregators,
+        "n_out": args.n_out,
+        "n_columns": args.n_columns,
+        "repeat": args.repeat,
+    }
+    records = run(
+        args.datasets,
+        args.n,
+        args.index,
+        args.aggregators,
+        args.n_out,
+        repeat=args.repeat,
+        memory=not args.no_memory,
+        n_columns=args.n_columns,
+    )
+    output = args.output or get_default_output(SUITE)
+    write_results(output, get_metadata(SUITE, config), records)
+    print(f"Wrote {len(records)} results to {output}", file=sys.stderr)
+    if not all(rec.get("identical", True) for rec in records):
+        sys.exit("The LTTB output differs from the plotly-resampler (lttbc) output")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Exactness and speed benchmark of the min/max pyramid window re-aggregation.
+
+For each (n, index, aggregator) case, random [start, end) windows of a synthetic
+random walk (the first window being the full series) are aggregated over the n_out
+grid via :meth:`agg_utils.pyramid.PyramidIndex.aggregate_n_out_grid` and via the O(n)
+``_aggregate`` of the ``M4Aggregator`` (or ``RangeMinMaxAggregator``) on
+``s.iloc[start:end]``. Each pyramid output is verified to be identical to the
+``_aggregate`` output, and as both rely on the (float bracketed) bin edge search of
+``_get_m4_bins``, these bin edges are verified against a plain ``np.searchsorted``.
+The wall time of both (over all windows) is reported, along with the pyramid build
+time. Besides the index kinds of the other suites, an uint64 index is checked.
+
+Usage (from the repository root)::
+
+    python -m benchmarks.bench_pyramid --quick
+    python -m benchmarks.bench_pyramid --n 10000000 --windows 50
+    python -m benchmarks.bench_pyramid --compare a.json b.json
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from agg_utils.aggregators import (
+    M4Aggregator,
+    RangeMinMaxAggregator,
+    _get_index_arr,
+    _get_m4_bins,
+)
+from agg_utils.pyramid import PyramidIndex
+
+from ._common import (
+    INDEX_KINDS,
+    compare_results,
+    get_default_output,
+    get_metadata,
+    make_series,
+    time_func,
+    write_results,
+)
+
+SUITE = "pyramid"
+N_GRID = [1_000_000, 10_000_000]
+N_OUT_GRID = [200, 1000, 4000]
+# NOTE: the unsigned index is not part of the (shared) INDEX_KINDS of the other
+# suites, as it only matters for the bin edge search
+CHECK_INDEX_KINDS = list(INDEX_KINDS) + ["uint64"]
+AGGREGATORS = {a.__name__: a for a in [M4Aggregator, RangeMinMaxAggregator]}
+KEY_COLS = ["n", "index", "aggregator"]
+
+
+def _make_series(n: int, index: str) -> pd.Series:
+    if index == "uint64":
+        s = make_series("walk", n, "range")
+        s.index = s.index.astype(np.uint64)
+        return s
+    return make_series("walk", n, index)
+
+
+def make_windows(n: int, n_windows: int, seed: int = 0) -> List[Tuple[int, int]]:
+    """Return the full series window, followed by random [start, end) windows."""
+    rng = np.random.default_rng(seed)
+    windows = [(0, n)]
+    for _ in range(n_windows - 1):
+        width = int(n * rng.uniform(0.01, 1))
+        start = int(rng.integers(0, n - width + 1))
+        windows.append((start, start + width))
+    return windows
+
+
+def _bins_identical(
+    s: pd.Series, windows: List[Tuple[int, int]], n_bins_grid: List[int]
+) -> bool:
+    """Check the `_get_m4_bins` edges against a plain ``np.searchsorted``."""
+    s_i = _get_index_arr(s)
+    for start, end in windows:
+        w_i = s_i[start:end]
+        for n_bins in n_bins_grid:
+            edges = np.linspace(w_i[0], w_i[-1], n_bins + 1)
+            bins = np.searchsorted(w_i.astype(np.float64), edges)
+            bins[-1] = len(w_i)
+            if not np.array_equal(_get_m4_bins(w_i, n_bins), np.unique(bins)):
+                return False
+    return True
+
+
+def run(
+    n_grid: List[int],
+    index_kinds: List[str],
+    aggregators: List[str],
+    n_out_grid: List[int],
+    n_windows: int = 20,
+    verbose: bool = True,
+) -> List[dict]:
+    """Run the benchmark and return a record per case."""
+    records = []
+    for n in n_grid:
+        windows = make_windows(n, n_windows)
+        for index in index_kinds:
+            s = _make_series(n, index)
+            t0 = time.perf_counter()
+            pyramid = PyramidIndex(s)
+            build_time = time.perf_counter() - t0
+            n_bins_grid = sorted({n_out // d for n_out in n_out_grid for d in (2, 4)})
+            bins_identical = _bins_identical(s, windows, n_bins_grid)
+            for name in aggregators:
+                agg, minmax = AGGREGATORS[name](), name != "M4Aggregator"
+
+                def _pyramid():
+                    return [
+                        pyramid.aggregate_n_out_grid(n_out_grid, start, end, minmax)
+                        for start, end in windows
+                    ]
+
+                def _aggregate():
+                    return [
+                        {
+                            n_out: agg._aggregate(s.iloc[start:end], n_out)
+                            for n_out in n_out_grid
+                        }
+                        for start, end in windows
+                    ]
+
+                identical = bins_identical and all(
+                    out_p[n_out].equals(out_a[n_out])
+                    for out_p, out_a in zip(_pyramid(), _aggregate())
+                    for n_out in n_out_grid
+                )
+                rec = {"n": n, "index": index, "aggregator": name}
+                rec.update({"n_windows": len(windows), "identical": identical})
+                rec["build_time_s"] = build_time
+                rec.update(time_func(_pyramid, repeat=3))
+                rec["aggregate_time_best_s"] = time_func(_aggregate, repeat=1)[
+                    "time_best_s"
+                ]
+                rec["speedup"] = rec["aggregate_time_best_s"] / rec["time_best_s"]
+                records.append(rec)
+                if verbose:
+                    print(
+                        f"n={n:<10} {index:<14} {name:<22} "
+                        f"build={build_time * 1e3:8.1f} ms "
+                        f"pyramid={rec['time_best_s'] * 1e3:8.2f} ms "
+                        f"_aggregate={rec['aggregate_time_best_s'] * 1e3:9.2f} ms "
+                        f"identical={identical}",
+                        flush=True,
+                    )
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n", type=int, nargs="+", default=N_GRID)
+    parser.add_argument("--n-out", type=int, nargs="+", default=N_OUT_GRID)
+    parser.add_argument(
+        "--index", nargs="+", default=CHECK_INDEX_KINDS, choices=CHECK_INDEX_KINDS
+    )
+    parser.add_argument(
+        "--aggregators",
+        nargs="+",
+        default=list(AGGREGATORS),
+        choices=list(AGGREGATORS),
+    )
+    parser.add_argument(
+        "--windows", type=int, default=20, help="the number of windows per case"
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="a smoke run; n=100k, 10 windows"
+    )
+    parser.add_argument("--output", help="the results JSON, by default in results/")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="compare two results files, instead of running the benchmark",
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(compare_results(*args.compare, key_cols=KEY_COLS))
+        return
+
+    if args.quick:
+        args.n, args.windows = [100_000], 10
+
+    config = {
+        "n": args.n,
+        "index": args.index,
+        "aggregators": args.aggregators,
+        "n_out": args.n_out,
+        "windows": args.windows,
+    }
+    records = run(args.n, args.index, args.aggregators, args.n_out, args.windows)
+    output = args.output or get_default_output(SUITE)
+    write_results(output, get_metadata(SUITE, config), records)
+    print(f"Wrote {len(records)} results to {output}", file=sys.stderr)
+    if not all(rec["identical"] for rec in records):
+        sys.exit("A pyramid output differs from the _aggregate output")
+
+
+if __name__ == "__main__":
+    main()
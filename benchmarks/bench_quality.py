@@ -0,0 +1,149 @@
+"""Speed versus visual quality benchmark of the aggregators.
+
+For each (dataset, n, aggregator, n_out) case, the aggregation time is measured, and
+the matplotlib figure of the aggregated series is compared to that of the full series
+(i.e., the reference) via :func:`agg_utils.metrics.compute_img_metrics`. As in the
+metric notebooks, the figures share the x- and y-range of the reference and the
+alpha channel is compared.
+
+Usage (from the repository root)::
+
+    python -m benchmarks.bench_quality --quick
+    python -m benchmarks.bench_quality --n 10000000 --aggregators MinMaxLTTB
+    python -m benchmarks.bench_quality --compare a.json b.json
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from agg_utils.fig_construction import return_matplotlib_arr
+from agg_utils.metrics import compute_img_metrics
+
+from ._common import (
+    DATASETS,
+    compare_results,
+    get_default_output,
+    get_metadata,
+    make_series,
+    time_func,
+    write_results,
+)
+from .bench_aggregators import AGGREGATORS, PIXEL_CASE
+
+SUITE = "quality"
+N_GRID = [1_000_000, 10_000_000]
+N_OUT_GRID = [200, 1000, 4000]
+KEY_COLS = ["dataset", "n", "aggregator", "n_out"]
+# The (alpha) channel of the images which is compared, as in the metric notebooks
+DIM = 3
+# The metrics (of `compute_img_metrics`) which are retained in the results
+METRICS = [
+    "DSSIM_ref_lw=1",
+    "DSSIM_masked_ref_lw=1",
+    "MSE_ref_lw=1",
+    "pixel_errors_ref_lw=1",
+]
+
+
+def _render(s: pd.Series, xlim, ylim) -> np.ndarray:
+    arr = return_matplotlib_arr(
+        s.index, s.values, line_width_px=1, xlim=xlim, ylim=ylim
+    )
+    return arr.astype(np.float32)
+
+
+def run(
+    datasets: List[str],
+    n_grid: List[int],
+    aggregators: List[str],
+    n_out_grid: List[int],
+    repeat: int = 3,
+    verbose: bool = True,
+) -> List[dict]:
+    """Run the benchmark and return a record per case."""
+    records = []
+    for n in n_grid:
+        for dataset in datasets:
+            s = make_series(dataset, n)
+            xlim = (s.index[0], s.index[-1])
+            ylim = (np.nanmin(s.values), np.nanmax(s.values))
+            ref = _render(s, xlim, ylim)
+            for name in aggregators:
+                agg = AGGREGATORS[name]()
+                # NOTE: the PixelM4Aggregator ignores the n_out, see bench_aggregators
+                n_outs = [4 * agg.width] if name == PIXEL_CASE else n_out_grid
+                for n_out in n_outs:
+                    rec = {"dataset": dataset, "n": n, "aggregator": name}
+                    rec["n_out"] = n_out
+                    rec.update(time_func(lambda: agg._aggregate(s, n_out), repeat))
+                    s_agg = agg._aggregate(s, n_out)
+                    img_metrics = compute_img_metrics(
+                        _render(s_agg, xlim, ylim), ref, ref, DIM, mse=True
+                    )
+                    rec.update(img_metrics[METRICS].astype(float).to_dict())
+                    records.append(rec)
+                    if verbose:
+                        print(
+                            f"{dataset:>5} n={n:<9} {name:<22} n_out={n_out:<5} "
+                            f"{rec['time_best_s'] * 1e3:10.2f} ms "
+                            f"DSSIM={rec['DSSIM_ref_lw=1']:.5f} "
+                            f"MSE={rec['MSE_ref_lw=1']:8.2f}",
+                            flush=True,
+                        )
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n", type=int, nargs="+", default=N_GRID)
+    parser.add_argument("--n-out", type=int, nargs="+", default=N_OUT_GRID)
+    parser.add_argument("--datasets", nargs="+", default=list(DATASETS))
+    parser.add_argument(
+        "--aggregators",
+        nargs="+",
+        default=["plotly_resampler.LTTB", "MinMaxLTTB", "M4Aggregator"],
+        choices=list(AGGREGATORS),
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--quick", action="store_true", help="a smoke run; n=200k, a single dataset"
+    )
+    parser.add_argument("--output", help="the results JSON, by default in results/")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="compare two results files, instead of running the benchmark",
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(compare_results(*args.compare, key_cols=KEY_COLS))
+        return
+
+    if args.quick:
+        args.n, args.datasets, args.repeat = [200_000], ["walk"], 1
+
+    config = {
+        "datasets": args.datasets,
+        "n": args.n,
+        "aggregators": args.aggregators,
+        "n_out": args.n_out,
+        "repeat": args.repeat,
+    }
+    records = run(args.datasets, args.n, args.aggregators, args.n_out, args.repeat)
+    output = args.output or get_default_output(SUITE)
+    write_results(output, get_metadata(SUITE, config), records)
+    print(f"Wrote {len(records)} results to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""Latency benchmark of the render and metric stages.
+
+For each (function, n, line width) case, the per-call latency distribution is
+measured of
+
+- the render stage: ``return_matplotlib_arr``, ``construct_matplotlib_fig`` (with the
+  agg and cairo backends), ``construct_plotly_fig``, and ``construct_bokeh_fig``,
+  which render a synthetic random walk of `n` points; and the session-based
+  ``PlotlyExporter.export`` and ``BokehExporter.export`` (i.e., versus these per-call
+  exports), whose session is started once and reused by all their calls;
+- the metric stage: ``_get_or_conv_mask``, ``_get_dssim_series``, and
+  ``_get_mse_series``, which compare the matplotlib image of the M4 aggregation
+  (with `n_out` points) to that of the `n` points (i.e., the reference).
+
+A function whose toolkit is not available (e.g., pycairo for the cairo backend,
+kaleido & Chrome for plotly, or a webdriver for bokeh) is probed once, and skipped
+(with its reason listed in the metadata of the results) when it fails. The probe
+also starts the session of the exporters, so their session start-up is not timed.
+
+Usage (from the repository root)::
+
+    python -m benchmarks.bench_render --quick
+    python -m benchmarks.bench_render --n 1000 100000 --line-widths 1 3
+    python -m benchmarks.bench_render --compare a.json b.json
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from agg_utils.aggregators import M4Aggregator
+from agg_utils.fig_construction import (
+    BokehExporter,
+    PlotlyExporter,
+    construct_bokeh_fig,
+    construct_matplotlib_fig,
+    construct_plotly_fig,
+    return_matplotlib_arr,
+)
+from agg_utils.metrics import _get_dssim_series, _get_mse_series, _get_or_conv_mask
+
+from ._common import (
+    compare_results,
+    get_default_output,
+    get_metadata,
+    make_series,
+    time_func,
+    write_results,
+)
+
+SUITE = "render"
+N_GRID = [1_000, 10_000, 100_000]
+LINE_WIDTHS = [1, 2, 3, 4]
+N_OUT = 1000
+# The (alpha) channel of the images which is compared, as in the metric notebooks
+DIM = 3
+KEY_COLS = ["stage", "function", "n", "line_width"]
+
+# The session-based exporters, which are started on their first call
+_EXPORTERS: Dict[type, object] = {}
+
+
+def _get_exporter(cls):
+    if cls not in _EXPORTERS:
+        _EXPORTERS[cls] = cls().start()
+    return _EXPORTERS[cls]
+
+
+def close_exporters():
+    """Close the sessions (e.g., the webdriver) of the started exporters."""
+    for exporter in _EXPORTERS.values():
+        exporter.close()
+    _EXPORTERS.clear()
+
+
+# The render functions; i.e., f(x, y, line_width, save_path, xlim, ylim)
+RENDER_FUNCS: Dict[str, Callable] = {
+    "return_matplotlib_arr": lambda x, y, lw, path, xlim, ylim: return_matplotlib_arr(
+        x, y, line_width_px=lw, xlim=xlim, ylim=ylim
+    ),
+    **{
+        f"construct_matplotlib_fig[{backend}]": (
+            lambda x, y, lw, path, xlim, ylim, backend=backend: construct_matplotlib_fig(
+                x, y, path, line_width_px=lw, xlim=xlim, ylim=ylim, backend=backend
+            )
+        )
+        for backend in ["agg", "cairo"]
+    },
+    "construct_plotly_fig": lambda x, y, lw, path, xlim, ylim: construct_plotly_fig(
+        x, y, path, line_width=lw, xlim=xlim, ylim=ylim
+    ),
+    "construct_bokeh_fig": lambda x, y, lw, path, xlim, ylim: construct_bokeh_fig(
+        x, y, path, line_width=lw, xlim=xlim, ylim=ylim
+    ),
+    **{
+        f"{cls.__name__}.export": (
+            lambda x, y, lw, path, xlim, ylim, cls=cls: _get_exporter(cls).export(
+                x, y, path, line_width=lw, xlim=xlim, ylim=ylim
+            )
+        )
+        for cls in [PlotlyExporter, BokehExporter]
+    },
+}
+# The functions which export via a (headless) browser; these are an order of
+# magnitude slower, so their number of calls is limited
+BROWSER_FUNCS = {
+    "construct_plotly_fig",
+    "construct_bokeh_fig",
+    "PlotlyExporter.export",
+    "BokehExporter.export",
+}
+
+# The metric functions; i.e., f(agg, ref, or_conv_mask)
+METRIC_FUNCS: Dict[str, Callable] = {
+    "_get_or_conv_mask": lambda agg, ref, mask: _get_or_conv_mask(
+        agg[:, :, DIM], ref[:, :, DIM]
+    ),
+    # NOTE: a fresh copy of the aggregated image is passed (without a reference key),
+    # so that no (cached) moments are reused in between the calls
+    "_get_dssim_series": lambda agg, ref, mask: _get_dssim_series(
+        agg.copy(), ref, DIM, mask
+    ),
+    "_get_mse_series": lambda agg, ref, mask: _get_mse_series(agg, ref, DIM, mask),
+}
+
+
+def _get_lims(s: pd.Series):
+    return (s.index[0], s.index[-1]), (np.nanmin(s.values), np.nanmax(s.values))
+
+
+def probe_render_funcs(names: List[str], tmp_dir: str) -> Dict[str, str]:
+    """Render a tiny figure with each function; return the reasons of the failures."""
+    s = make_series("walk", 10)
+    xlim, ylim = _get_lims(s)
+    skipped = {}
+    for name in names:
+        try:
+            path = os.path.join(tmp_dir, "probe.png")
+            RENDER_FUNCS[name](s.index, s.values, 1, path, xlim, ylim)
+        except Exception as e:  # e.g., a missing browser or backend
+            skipped[name] = f"{type(e).__name__}: {str(e).strip().splitlines()[0]}"
+    return skipped
+
+
+def run(
+    n_grid: List[int],
+    line_widths: List[int],
+    render_funcs: List[str],
+    metric_funcs: List[str],
+    n_out: int = N_OUT,
+    repeat: int = 20,
+    browser_repeat: int = 5,
+    verbose: bool = True,
+) -> List[dict]:
+    """Run the benchmark and return a record per case."""
+    records = []
+
+    def _bench(stage: str, name: str, n: int, lw: int, func: Callable, repeat: int):
+        # NOTE: min_time=0, so that each case has the same number of calls
+        rec = {"stage": stage, "function": name, "n": n, "line_width": lw}
+        rec.update(time_func(func, repeat=repeat, min_time=0))
+        records.append(rec)
+        if verbose:
+            print(
+                f"{stage:<6} {name:<32} n={n:<8} lw={lw} "
+                f"p50={rec['time_median_s'] * 1e3:9.2f} ms "
+                f"p90={rec['time_p90_s'] * 1e3:9.2f} ms",
+                flush=True,
+            )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "fig.png")
+        for n in n_grid:
+            s = make_series("walk", n)
+            s_agg = M4Aggregator()._aggregate(s, min(n_out, n - n % 4))
+            xlim, ylim = _get_lims(s)
+            x, y = s.index, s.values
+            for lw in line_widths:
+                for name in render_funcs:
+                    func = RENDER_FUNCS[name]
+                    n_calls = browser_repeat if name in BROWSER_FUNCS else repeat
+                    _bench(
+                        "render",
+                        name,
+                        n,
+                        lw,
+                        lambda: func(x, y, lw, path, xlim, ylim),
+                        n_calls,
+                    )
+
+                if not metric_funcs:
+                    continue
+                # NOTE: the images are float32 in [0, 255], as in the metric stage
+                ref, agg = (
+                    return_matplotlib_arr(
+                        s_.index, s_.values, line_width_px=lw, xlim=xlim, ylim=ylim
+                    ).astype(np.float32)
+                    for s_ in (s, s_agg)
+                )
+                mask = _get_or_conv_mask(agg[:, :, DIM], ref[:, :, DIM])
+                for name in metric_funcs:
+                    func = METRIC_FUNCS[name]
+                    _bench("metric", name, n, lw, lambda: func(agg, ref, mask), repeat)
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n", type=int, nargs="+", default=N_GRID)
+    parser.add_argument("--line-widths", type=int, nargs="+", default=LINE_WIDTHS)
+    parser.add_argument("--n-out", type=int, default=N_OUT)
+    parser.add_argument(
+        "--functions",
+        nargs="+",
+        default=list(RENDER_FUNCS) + list(METRIC_FUNCS),
+        choices=list(RENDER_FUNCS) + list(METRIC_FUNCS),
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--browser-repeat",
+        type=int,
+        default=5,
+        help="the number of calls of the browser-based (plotly & bokeh) exports",
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="a smoke run; n=1000, lw=1, 5 calls"
+    )
+    parser.add_argument("--output", help="the results JSON, by default in results/")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="compare two results files, instead of running the benchmark",
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(compare_results(*args.compare, key_cols=KEY_COLS))
+        return
+
+    if args.quick:
+        args.n, args.line_widths = [1_000], [1]
+        args.repeat, args.browser_repeat = 5, 2
+
+    render_funcs = [f for f in args.functions if f in RENDER_FUNCS]
+    metric_funcs = [f for f in args.functions if f in METRIC_FUNCS]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        skipped = probe_render_funcs(render_funcs, tmp_dir)
+    for name, reason in skipped.items():
+        print(f"Skipping {name}; {reason}", file=sys.stderr)
+    render_funcs = [f for f in render_funcs if f not in skipped]
+
+    config = {
+        "n": args.n,
+        "line_widths": args.line_widths,
+        "n_out": args.n_out,
+        "functions": args.functions,
+        "repeat": args.repeat,
+        "browser_repeat": args.browser_repeat,
+    }
+    try:
+        records = run(
+            args.n,
+            args.line_widths,
+            render_funcs,
+            metric_funcs,
+            n_out=args.n_out,
+            repeat=args.repeat,
+            browser_repeat=args.browser_repeat,
+        )
+    finally:
+        close_exporters()
+    metadata = get_metadata(SUITE, config)
+    metadata["skipped"] = skipped
+    output = args.output or get_default_output(SUITE)
+    write_results(output, metadata, records)
+    print(f"Wrote {len(records)} results to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
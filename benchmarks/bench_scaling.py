@@ -0,0 +1,153 @@
+"""Thread scaling benchmark of the (multi-threaded) M4 aggregation of a single series.
+
+For each (n, aggregator, n_out, threads) case, the wall time of aggregating a
+synthetic random walk with ``M4Aggregator(threads=threads)`` (or its MinMax variant)
+is measured, along with the speedup and the parallel efficiency w.r.t. a single
+thread. Each multi-threaded output is verified to be identical to the
+single-threaded output.
+
+Usage (from the repository root)::
+
+    python -m benchmarks.bench_scaling --quick
+    python -m benchmarks.bench_scaling --n 100000000 --threads 1 2 4 8 16 32 48
+    python -m benchmarks.bench_scaling --compare a.json b.json
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from typing import List
+
+import pandas as pd
+
+from agg_utils.aggregators import M4Aggregator, RangeMinMaxAggregator
+
+from ._common import (
+    INDEX_KINDS,
+    compare_results,
+    get_default_output,
+    get_metadata,
+    make_series,
+    time_func,
+    write_results,
+)
+
+SUITE = "scaling"
+N_GRID = [10_000_000, 100_000_000]
+N_OUT_GRID = [4000]
+AGGREGATORS = {a.__name__: a for a in [M4Aggregator, RangeMinMaxAggregator]}
+KEY_COLS = ["n", "index", "aggregator", "n_out", "threads"]
+
+
+def _get_thread_grid() -> List[int]:
+    """Return 1, 2, 4, ... threads, up to (and including) the CPU count."""
+    cpu_count = os.cpu_count() or 1
+    grid = [2**i for i in range(cpu_count.bit_length()) if 2**i < cpu_count]
+    return grid + [cpu_count]
+
+
+def run(
+    n_grid: List[int],
+    index: str,
+    aggregators: List[str],
+    n_out_grid: List[int],
+    thread_grid: List[int],
+    repeat: int = 5,
+    verbose: bool = True,
+) -> List[dict]:
+    """Run the benchmark and return a record per case."""
+    records = []
+    for n in n_grid:
+        s = make_series("walk", n, index)
+        for name in aggregators:
+            for n_out in n_out_grid:
+                reference = AGGREGATORS[name](threads=1)._aggregate(s, n_out)
+                time_1 = None
+                for threads in thread_grid:
+                    agg = AGGREGATORS[name](threads=threads)
+                    rec = {"n": n, "index": index, "aggregator": name}
+                    rec.update({"n_out": n_out, "threads": threads})
+                    rec["identical"] = bool(agg._aggregate(s, n_out).equals(reference))
+                    rec.update(time_func(lambda: agg._aggregate(s, n_out), repeat))
+                    if threads == 1:
+                        time_1 = rec["time_best_s"]
+                    rec["points_per_s"] = n / rec["time_best_s"]
+                    if time_1 is not None:
+                        rec["speedup"] = time_1 / rec["time_best_s"]
+                        rec["efficiency"] = rec["speedup"] / threads
+                    records.append(rec)
+                    if verbose:
+                        print(
+                            f"n={n:<10} {name:<22} n_out={n_out:<5} "
+                            f"threads={threads:<3} {rec['time_best_s'] * 1e3:10.2f} ms "
+                            f"speedup={rec.get('speedup', float('nan')):5.2f} "
+                            f"identical={rec['identical']}",
+                            flush=True,
+                        )
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n", type=int, nargs="+", default=N_GRID)
+    parser.add_argument("--n-out", type=int, nargs="+", default=N_OUT_GRID)
+    parser.add_argument("--index", default="datetime", choices=list(INDEX_KINDS))
+    parser.add_argument(
+        "--aggregators",
+        nargs="+",
+        default=list(AGGREGATORS),
+        choices=list(AGGREGATORS),
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        default=_get_thread_grid(),
+        help="the thread counts, by default 1, 2, 4, ..., up to the CPU count",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--quick", action="store_true", help="a smoke run; n=2M, M4 only"
+    )
+    parser.add_argument("--output", help="the results JSON, by default in results/")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="compare two results files, instead of running the benchmark",
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(compare_results(*args.compare, key_cols=KEY_COLS))
+        return
+
+    if args.quick:
+        args.n, args.aggregators, args.repeat = [2_000_000], ["M4Aggregator"], 3
+    # NOTE: the single-threaded case is the reference of the speedup
+    thread_grid = sorted(set(args.threads) | {1})
+
+    config = {
+        "n": args.n,
+        "index": args.index,
+        "aggregators": args.aggregators,
+        "n_out": args.n_out,
+        "threads": thread_grid,
+        "repeat": args.repeat,
+    }
+    records = run(
+        args.n, args.index, args.aggregators, args.n_out, thread_grid, args.repeat
+    )
+    output = args.output or get_default_output(SUITE)
+    write_results(output, get_metadata(SUITE, config), records)
+    print(f"Wrote {len(records)} results to {output}", file=sys.stderr)
+    if not all(rec["identical"] for rec in records):
+        sys.exit("A multi-threaded output differs from the single-threaded output")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""Latency and throughput benchmark of the aggregation server under concurrent load.
+
+An in-process :class:`agg_utils.server.AggregationServer` serves a synthetic random
+walk (with a datetime index), while `clients` concurrent clients (each with its own
+keep-alive connection) replay a pan & zoom session; i.e., a sequence of random
+:data:`agg_utils.stability.ACTIONS` with an offset of 1-20% of the window width.
+Clients with the same session index replay the same session, so identical requests
+arrive concurrently (and are coalesced). For each (aggregator, clients) case, the
+latency distribution of all requests (and per cache status) and the throughput are
+reported, along with the server its cache counts.
+
+Usage (from the repository root)::
+
+    python -m benchmarks.bench_server --quick
+    python -m benchmarks.bench_server --clients 1 8 32 --executor process --workers 4
+    python -m benchmarks.bench_server --compare a.json b.json
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from agg_utils.server import AGGREGATORS, AggregationClient, AggregationServer
+from agg_utils.stability import ACTIONS
+
+from ._common import (
+    compare_results,
+    get_default_output,
+    get_metadata,
+    latency_stats,
+    make_series,
+    write_results,
+)
+
+SUITE = "server"
+N = 10_000_000
+N_OUT = 1000
+CLIENT_GRID = [1, 4, 16]
+KEY_COLS = ["aggregator", "clients", "executor"]
+# NOTE: the best latency is that of a cache hit; compare the runs on the median
+COMPARE_METRIC = "time_median_s"
+
+
+def make_session(
+    s: pd.Series, n_requests: int, seed: int
+) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """Return the (x0, x1) windows of a random pan & zoom session over `s`."""
+    rng = np.random.default_rng(seed)
+    x_min, x_max = s.index[0], s.index[-1]
+    min_width = (x_max - x_min) / 1000
+    x0, x1 = x_min, x_max
+    windows = []
+    for _ in range(n_requests):
+        action = ACTIONS[rng.integers(len(ACTIONS))]
+        offset = (x1 - x0) * rng.uniform(0.01, 0.2)
+        x0_, x1_ = x0 + action.sign_l * offset, x1 + action.sign_r * offset
+        x0_, x1_ = max(x0_, x_min), min(x1_, x_max)
+        if x1_ - x0_ >= min_width:
+            x0, x1 = x0_, x1_
+        windows.append((x0, x1))
+    return windows
+
+
+async def _run_case(
+    server: AggregationServer,
+    port: int,
+    sessions: List[List[Tuple[pd.Timestamp, pd.Timestamp]]],
+    clients: int,
+    aggregator: str,
+    n: int,
+    n_out: int,
+) -> Tuple[List[float], Dict[str, List[float]], float]:
+    """Replay the sessions with `clients` concurrent clients."""
+    latencies: List[float] = []
+    by_cache: Dict[str, List[float]] = {}
+
+    async def _client(i: int):
+        async with AggregationClient("127.0.0.1", port) as client:
+            for x0, x1 in sessions[i % len(sessions)]:
+                t0 = time.perf_counter()
+                status, headers, _ = await client.get(
+                    "/aggregate",
+                    data="walk",
+                    n=n,
+                    aggregator=aggregator,
+                    n_out=n_out,
+                    x0=x0.isoformat(),
+                    x1=x1.isoformat(),
+                )
+                dt = time.perf_counter() - t0
+                assert status == 200, f"request failed with status {status}"
+                latencies.append(dt)
+                by_cache.setdefault(headers.get("x-cache", ""), []).append(dt)
+
+    t_start = time.perf_counter()
+    await asyncio.gather(*(_client(i) for i in range(clients)))
+    return latencies, by_cache, time.perf_counter() - t_start
+
+
+async def _run(
+    n: int,
+    n_out: int,
+    aggregators: List[str],
+    client_grid: List[int],
+    n_requests: int,
+    executor: str,
+    workers: int,
+    verbose: bool = True,
+) -> List[dict]:
+    s = make_series("walk", n, "datetime")
+    records = []
+    for aggregator in aggregators:
+        for clients in client_grid:
+            # NOTE: a fresh server (i.e., a cold cache) per case; and half as many
+            # sessions as clients, so that identical requests arrive concurrently
+            server = AggregationServer(executor=executor, workers=workers)
+            server.add_series("walk", n, s)
+            port = await server.start(port=0)
+            sessions = [
+                make_session(s, n_requests, seed)
+                for seed in range(max(1, clients // 2))
+            ]
+            try:
+                latencies, by_cache, wall_time = await _run_case(
+                    server, port, sessions, clients, aggregator, n, n_out
+                )
+                stats = server.stats()
+            finally:
+                await server.close()
+
+            rec = {
+                "aggregator": aggregator,
+                "clients": clients,
+                "executor": executor,
+                "workers": workers,
+                "n": n,
+                "n_out": n_out,
+                **latency_stats(latencies),
+                "requests_per_s": len(latencies) / wall_time,
+            }
+            for cache, times in by_cache.items():
+                rec[f"n_{cache}"] = len(times)
+                rec[f"time_median_{cache}_s"] = float(np.median(times))
+            rec["cache_entries"] = stats["cache_entries"]
+            records.append(rec)
+            if verbose:
+                print(
+                    f"{aggregator:<22} clients={clients:<3} "
+                    f"{rec['requests_per_s']:8.1f} req/s "
+                    f"p50={rec['time_median_s'] * 1e3:8.2f} ms "
+                    f"p99={rec['time_p99_s'] * 1e3:8.2f} ms "
+                    f"hit/miss/coalesced={stats['hit']}/{stats['miss']}/"
+                    f"{stats['coalesced']}",
+                    flush=True,
+                )
+    return records
+
+
+def run(
+    n: int,
+    n_out: int,
+    aggregators: List[str],
+    client_grid: List[int],
+    n_requests: int = 50,
+    executor: str = "thread",
+    workers: int = 4,
+    verbose: bool = True,
+) -> List[dict]:
+    """Run the benchmark and return a record per case."""
+    return asyncio.run(
+        _run(n, n_out, aggregators, client_grid, n_requests, executor, workers, verbose)
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n", type=int, default=N)
+    parser.add_argument("--n-out", type=int, default=N_OUT)
+    parser.add_argument(
+        "--aggregators",
+        nargs="+",
+        default=["M4Aggregator", "MinMaxLTTB"],
+        choices=list(AGGREGATORS),
+    )
+    parser.add_argument("--clients", type=int, nargs="+", default=CLIENT_GRID)
+    parser.add_argument(
+        "--requests", type=int, default=50, help="the number of requests per client"
+    )
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--quick", action="store_true", help="a smoke run; n=1M, 20 requests, M4"
+    )
+    parser.add_argument("--output", help="the results JSON, by default in results/")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="compare two results files, instead of running the benchmark",
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(
+                compare_results(*args.compare, key_cols=KEY_COLS, metric=COMPARE_METRIC)
+            )
+        return
+
+    if args.quick:
+        args.n, args.requests, args.aggregators = 1_000_000, 20, ["M4Aggregator"]
+
+    config = {
+        "n": args.n,
+        "n_out": args.n_out,
+        "aggregators": args.aggregators,
+        "clients": args.clients,
+        "requests": args.requests,
+        "executor": args.executor,
+        "workers": args.workers,
+    }
+    records = run(
+        args.n,
+        args.n_out,
+        args.aggregators,
+        args.clients,
+        args.requests,
+        args.executor,
+        args.workers,
+    )
+    output = args.output or get_default_output(SUITE)
+    write_results(output, get_metadata(SUITE, config), records)
+    print(f"Wrote {len(records)} results to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()